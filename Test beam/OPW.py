@@ -1,106 +1,454 @@
+import os
+import re
+import hashlib
+import argparse
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from scurve_fit import fit_scans
+from profiling import stage, count, add_profile_args, start_profiling, finish_profiling
+
+DEFAULT_WORKBOOK = r'R3_39\scan7_s27\R3_39_s27.xlsx'
+BEAM_INFO = 'ATLAS ITk beam test, @ DESY TB Dec. 2024, 5 GeV/c electrons'
+NOISE_CUTOFF = 1e-3
+EFFICIENCY_CUTOFF = 99
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'opw')
+
+def cache_entry(path):
+    cache_dir = os.environ.get('OPW_CACHE_DIR') or DEFAULT_CACHE_DIR
+    key = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir, f"{key}.npz")
+
+def read_cached_sheet(path, stat):
+    try:
+        with np.load(cache_entry(path), allow_pickle=False) as npz:
+            if int(npz['size']) != stat.st_size or int(npz['mtime_ns']) != stat.st_mtime_ns:
+                return None
+            columns = [int(column) for column in npz['columns']]
+            return pd.DataFrame({column: npz[f"c{column}"] for column in columns}, columns=columns)
+    except (OSError, ValueError, KeyError):
+        return None
+
+def write_cached_sheet(path, stat, data):
+    arrays = {f"c{column}": data[column].to_numpy() for column in data.columns}
+    if any(array.dtype.kind not in 'biuf' for array in arrays.values()):
+        return False                    # text cells: keep reading this workbook with openpyxl
+    entry = cache_entry(path)
+    tmp = f"{entry}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        with open(tmp, 'wb') as f:
+            np.savez(f, size=stat.st_size, mtime_ns=stat.st_mtime_ns,
+                     columns=np.array(list(data.columns), dtype=int), **arrays)
+        os.replace(tmp, entry)
+        return True
+    except OSError as e:
+        print(f"Cache write failed for {path}: {str(e)}")
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        return False
+
+def read_workbook(path):
+    count('workbooks')
+    count('workbook_bytes', os.path.getsize(path))
+    with stage('read_excel'):
+        return pd.read_excel(path, sheet_name='Sheet1', header=None)
+
+def read_scan_sheet(path):
+    # Sheet1 of a scan workbook, converted once to a columnar .npz keyed on size and mtime
+    if os.environ.get('OPW_CACHE', '1') == '0':
+        return read_workbook(path)
+    stat = os.stat(path)
+    data = read_cached_sheet(path, stat)
+    if data is None:
+        data = read_workbook(path)
+        write_cached_sheet(path, stat, data)
+    else:
+        count('cache_hits')
+    return data
+
+def load_scan(path):
+    with stage('load'):
+        data = read_scan_sheet(path)
+    noise_data = data[[0, 1]].dropna().rename(columns={0: 'Threshold', 1: 'NoiseOccupancy'})
+    efficiency_data = data[[0, 2]].dropna().rename(columns={0: 'Threshold', 2: 'Efficiency'})
+
+    noise_data = noise_data.sort_values(by='Threshold')
+    efficiency_data = efficiency_data.sort_values(by='Threshold')
+    return noise_data, efficiency_data
+
+def crossing_fraction(y1, y2, cutoffs, log=False):
+    # position of the cutoff between y1 and y2, linear in y or in log10(y)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = (cutoffs - y1)/(y2 - y1)
+        if log:
+            # a zero occupancy endpoint has no log, those crossings stay linear
+            t_log = (np.log10(cutoffs) - np.log10(y1))/(np.log10(y2) - np.log10(y1))
+            t = np.where((y1 > 0) & (y2 > 0) & np.isfinite(t_log), t_log, t)
+    return t
+
+def find_crossings(x, y, cutoffs, log=False):
+    # every crossing of y through every cutoff: (cutoff index, interpolated x) pairs
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    cutoffs = np.atleast_1d(np.asarray(cutoffs, dtype=float))
+    order = np.argsort(x, kind='stable')
+    x, y = x[order], y[order]
+
+    above = y[None, :] >= cutoffs[:, None]
+    cut_idx, i = np.nonzero(above[:, 1:] != above[:, :-1])
+    t = crossing_fraction(y[i], y[i + 1], cutoffs[cut_idx], log)
+    return cut_idx, x[i] + t*(x[i + 1] - x[i])
+
+def interpolate_cutoffs(x, y, cutoffs, search_direction='right', log=False):
+    # first crossing in the search direction for each cutoff, NaN if there is none
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    cutoffs = np.atleast_1d(np.asarray(cutoffs, dtype=float))
+    order = np.argsort(x, kind='stable')
+    if search_direction != 'left':
+        order = order[::-1]
+    x, y = x[order], y[order]
 
-data = pd.read_excel('R3_39\scan7_s27\R3_39_s27.xlsx', sheet_name='Sheet1', header=None) 
-noise_data = data[[0, 1]].dropna().rename(columns={0: 'Threshold', 1: 'NoiseOccupancy'})
-efficiency_data = data[[0, 2]].dropna().rename(columns={0: 'Threshold', 2: 'Efficiency'})
-
-noise_data = noise_data.sort_values(by='Threshold')
-efficiency_data = efficiency_data.sort_values(by='Threshold')
-
-fig, ax1 = plt.subplots(figsize=(10, 8))
-
-plt.suptitle('ATLAS ITk Working in Progress (private work)', fontsize=14, fontweight='bold')
-plt.title('ATLAS ITk beam test, @ DESY TB Dec. 2024, 5 GeV/c electrons, R3_39_s27, ABC: 0,1', fontsize=10)
-
-ax1.set_xlabel('Threshold (DAC)', fontsize=12)
-ax1.set_ylabel('Noise Occupancy', color='blue', fontsize=12)
-ax1.plot(noise_data['Threshold'], noise_data['NoiseOccupancy'], color='blue', marker='o', linestyle='-', label='Noise Occupancy')
-ax1.set_yscale('log')
-ax1.set_yticks([1e-1, 1e-2, 1e-3, 1e-4, 1e-5, 1e-6, 1e-7])  
-ax1.tick_params(axis='y', labelcolor='blue')
-ax1.set_xlim(0, 175)
-ax1.set_xticks(range(0, 176, 25)) 
-ax1.axhline(y=1e-3, color='blue', linestyle='--', label='Noise Cut-off (10^{-3})')
-
-ax2 = ax1.twinx()
-ax2.set_ylabel('Efficiency (%)', color='red', fontsize=12)
-ax2.plot(efficiency_data['Threshold'], efficiency_data['Efficiency'], color='red', marker='x', linestyle='-', label='Efficiency')
-ax2.tick_params(axis='y', labelcolor='red')
-ax2.axhline(y=99, color='red', linestyle='--', label='Efficiency Cut-off (99%)')
-
-def interpolate_cutoff(df, x_col, y_col, cutoff, search_direction='right'):
-    ascending = True if search_direction == 'left' else False
-    sorted_df = df.sort_values(x_col, ascending=ascending).reset_index(drop=True)
-    
     if search_direction == 'left':
-        condition = lambda y: y <= cutoff  
+        passing = y[None, :] <= cutoffs[:, None]
     else:
-        condition = lambda y: y >= cutoff  
-
-    for i in range(len(sorted_df)-1):
-        x1, y1 = sorted_df.iloc[i][[x_col, y_col]]
-        x2, y2 = sorted_df.iloc[i+1][[x_col, y_col]]
-        if (condition(y1) != condition(y2)):
-            t = (cutoff - y1)/(y2 - y1)
-            return x1 + t*(x2 - x1)
-    
+        passing = y[None, :] >= cutoffs[:, None]
+
+    result = np.full(cutoffs.shape, np.nan)
+    if x.size >= 2:
+        change = passing[:, 1:] != passing[:, :-1]
+        found = change.any(axis=1)
+        i = change.argmax(axis=1)
+        t = crossing_fraction(y[i], y[i + 1], cutoffs, log)
+        result = np.where(found, x[i] + t*(x[i + 1] - x[i]), np.nan)
+    else:
+        found = np.zeros(cutoffs.shape, dtype=bool)
+
+    # no crossing: outermost point that passes the cut
     if search_direction == 'left':
-        valid_points = sorted_df[sorted_df[y_col] <= cutoff]
-        return valid_points[x_col].min() if not valid_points.empty else None
+        fallback = np.where(passing, x[None, :], np.inf).min(axis=1, initial=np.inf)
     else:
-        valid_points = sorted_df[sorted_df[y_col] >= cutoff]
-        return valid_points[x_col].max() if not valid_points.empty else None
-
-noise_cutoff = interpolate_cutoff(
-    noise_data, 
-    'Threshold', 
-    'NoiseOccupancy', 
-    cutoff=1e-3,
-    search_direction='left'  
-)
-
-efficiency_cutoff = interpolate_cutoff(
-    efficiency_data,
-    'Threshold',
-    'Efficiency',
-    cutoff=99,
-    search_direction='right'  
-)
-if noise_cutoff is not None and efficiency_cutoff is not None:
-    left = min(noise_cutoff, efficiency_cutoff)
-    right = max(noise_cutoff, efficiency_cutoff)
-    ax1.axvspan(left, right, color='green', alpha=0.3, label='Operating Window')
-else:
-    print("Warning: no valid OPW")
-
-fig.legend(loc='upper right', bbox_to_anchor=(0.9, 0.82))
-
-if noise_cutoff < efficiency_cutoff:
-    window_width = efficiency_cutoff - noise_cutoff
-    ax1.text(
-        x=147,  
-        y=4e-3,  
-        s=f'Window range: [{noise_cutoff:.1f}, {efficiency_cutoff:.1f}] DAC',
-        ha='center',
-        va='bottom',
-        color='green',
-        fontsize=10,
-        bbox=dict(facecolor='white', alpha=0.8)
+        fallback = np.where(passing, x[None, :], -np.inf).max(axis=1, initial=-np.inf)
+    fallback = np.where(np.isfinite(fallback), fallback, np.nan)
+    return np.where(found, result, fallback)
+
+def interpolate_cutoff(df, x_col, y_col, cutoff, search_direction='right', log=False):
+    value = interpolate_cutoffs(df[x_col], df[y_col], cutoff, search_direction, log)[0]
+    return None if np.isnan(value) else value
+
+def operating_window(noise_data, efficiency_data, noise_cut=NOISE_CUTOFF, efficiency_cut=EFFICIENCY_CUTOFF):
+    noise_cutoff = interpolate_cutoff(
+        noise_data,
+        'Threshold',
+        'NoiseOccupancy',
+        cutoff=noise_cut,
+        search_direction='left'
     )
-    ax1.text(
-        x=153,  
-        y=1.5e-3,  
-        s=f'Window width: {window_width:.1f} DAC',
-        ha='center',
-        va='bottom',
-        color='green',
-        fontsize=10,
-        bbox=dict(facecolor='white', alpha=0.8)
+
+    efficiency_cutoff = interpolate_cutoff(
+        efficiency_data,
+        'Threshold',
+        'Efficiency',
+        cutoff=efficiency_cut,
+        search_direction='right'
     )
-    print(f'OPW range: [{noise_cutoff:.1f}, {efficiency_cutoff:.1f}] DAC')
-    print(f'OPW width: {window_width:.1f} DAC')
-else:
-    print("Warning: no valid operating window, noise threshold higher than efficiency threshold")
+    return noise_cutoff, efficiency_cutoff
+
+def valid_window(noise_cutoff, efficiency_cutoff):
+    return noise_cutoff is not None and efficiency_cutoff is not None and noise_cutoff < efficiency_cutoff
+
+def opw_sensitivity(noise_data, efficiency_data, noise_cuts, efficiency_cuts, log_noise=False):
+    # operating window for every (noise cut, efficiency cut) pair
+    noise_cutoffs = interpolate_cutoffs(noise_data['Threshold'], noise_data['NoiseOccupancy'],
+                                        noise_cuts, search_direction='left', log=log_noise)
+    efficiency_cutoffs = interpolate_cutoffs(efficiency_data['Threshold'], efficiency_data['Efficiency'],
+                                             efficiency_cuts, search_direction='right')
+    noise_grid, efficiency_grid = np.meshgrid(noise_cutoffs, efficiency_cutoffs, indexing='ij')
+    width = efficiency_grid - noise_grid
+    width[~(width > 0)] = np.nan
+    noise_cut_grid, efficiency_cut_grid = np.meshgrid(noise_cuts, efficiency_cuts, indexing='ij')
+    return pd.DataFrame({
+        'noise_cut': noise_cut_grid.ravel(),
+        'efficiency_cut': efficiency_cut_grid.ravel(),
+        'noise_cutoff': noise_grid.ravel(),
+        'efficiency_cutoff': efficiency_grid.ravel(),
+        'opw_width': width.ravel()
+    })
+
+def plot_opw(noise_data, efficiency_data, noise_cutoff, efficiency_cutoff, title, output_path):
+    fig, ax1 = plt.subplots(figsize=(10, 8))
+
+    plt.suptitle('ATLAS ITk Working in Progress (private work)', fontsize=14, fontweight='bold')
+    plt.title(title, fontsize=10)
+
+    ax1.set_xlabel('Threshold (DAC)', fontsize=12)
+    ax1.set_ylabel('Noise Occupancy', color='blue', fontsize=12)
+    ax1.plot(noise_data['Threshold'], noise_data['NoiseOccupancy'], color='blue', marker='o', linestyle='-', label='Noise Occupancy')
+    ax1.set_yscale('log')
+    ax1.set_yticks([1e-1, 1e-2, 1e-3, 1e-4, 1e-5, 1e-6, 1e-7])
+    ax1.tick_params(axis='y', labelcolor='blue')
+    ax1.set_xlim(0, 175)
+    ax1.set_xticks(range(0, 176, 25))
+    ax1.axhline(y=1e-3, color='blue', linestyle='--', label='Noise Cut-off (10^{-3})')
+
+    ax2 = ax1.twinx()
+    ax2.set_ylabel('Efficiency (%)', color='red', fontsize=12)
+    ax2.plot(efficiency_data['Threshold'], efficiency_data['Efficiency'], color='red', marker='x', linestyle='-', label='Efficiency')
+    ax2.tick_params(axis='y', labelcolor='red')
+    ax2.axhline(y=99, color='red', linestyle='--', label='Efficiency Cut-off (99%)')
+
+    if noise_cutoff is not None and efficiency_cutoff is not None:
+        left = min(noise_cutoff, efficiency_cutoff)
+        right = max(noise_cutoff, efficiency_cutoff)
+        ax1.axvspan(left, right, color='green', alpha=0.3, label='Operating Window')
+
+    fig.legend(loc='upper right', bbox_to_anchor=(0.9, 0.82))
+
+    if valid_window(noise_cutoff, efficiency_cutoff):
+        window_width = efficiency_cutoff - noise_cutoff
+        ax1.text(
+            x=147,
+            y=4e-3,
+            s=f'Window range: [{noise_cutoff:.1f}, {efficiency_cutoff:.1f}] DAC',
+            ha='center',
+            va='bottom',
+            color='green',
+            fontsize=10,
+            bbox=dict(facecolor='white', alpha=0.8)
+        )
+        ax1.text(
+            x=153,
+            y=1.5e-3,
+            s=f'Window width: {window_width:.1f} DAC',
+            ha='center',
+            va='bottom',
+            color='green',
+            fontsize=10,
+            bbox=dict(facecolor='white', alpha=0.8)
+        )
+
+    with stage('savefig'):
+        plt.savefig(output_path)
+    plt.close(fig)
+
+def scan_info(path):
+    # <sensor>/<scan>/<sensor>_s<N>[_<abc>_<abc>].xlsx
+    parts = re.split(r'[\\/]+', os.fspath(path))
+    stem = os.path.splitext(parts[-1])[0]
+    match = re.match(r'^(?P<tag>.*?_s\d+)(?:_(?P<abcs>\d+(?:_\d+)*))?$', stem)
+    tag = match.group('tag') if match else stem
+    abcs = match.group('abcs') if match and match.group('abcs') else ''
+    return {
+        'sensor': parts[-3] if len(parts) >= 3 else '',
+        'scan': parts[-2] if len(parts) >= 2 else '',
+        'tag': tag,
+        'ABCs': abcs.replace('_', ',')
+    }
+
+def analyse_workbook(path, plot_dir=None, abcs=None):
+    info = scan_info(path)
+    if abcs is not None:
+        info['ABCs'] = abcs
+    summary = {'workbook': os.fspath(path), 'sensor': info['sensor'], 'scan': info['scan'], 'ABCs': info['ABCs']}
+
+    noise_data, efficiency_data = load_scan(path)
+    with stage('operating_window'):
+        noise_cutoff, efficiency_cutoff = operating_window(noise_data, efficiency_data)
+    summary['noise_cutoff'] = noise_cutoff
+    summary['efficiency_cutoff'] = efficiency_cutoff
+    if valid_window(noise_cutoff, efficiency_cutoff):
+        summary['opw_low'] = noise_cutoff
+        summary['opw_high'] = efficiency_cutoff
+        summary['opw_width'] = efficiency_cutoff - noise_cutoff
+    else:
+        summary['opw_low'] = summary['opw_high'] = summary['opw_width'] = None
+
+    if plot_dir is not None:
+        if plt.get_backend().lower() != 'agg':
+            plt.switch_backend('Agg')       # headless, also in spawned worker processes
+        abc_suffix = '_' + info['ABCs'].replace(',', '_') if info['ABCs'] else ''
+        title = f"{BEAM_INFO}, {info['tag']}, ABC: {info['ABCs'] or 'n/a'}"
+        output_path = os.path.join(plot_dir, f"{info['tag']}{abc_suffix}.png")
+        with stage('plot'):
+            plot_opw(noise_data, efficiency_data, noise_cutoff, efficiency_cutoff, title, output_path)
+        summary['plot'] = output_path
+    return summary
+
+def analyse_workbook_safe(path, plot_dir=None):
+    try:
+        return analyse_workbook(path, plot_dir)
+    except Exception as e:
+        return {'workbook': os.fspath(path), **{k: v for k, v in scan_info(path).items() if k != 'tag'},
+                'error': str(e)}
+
+def workbook_sensitivity(path, noise_cuts, efficiency_cuts, log_noise=False):
+    try:
+        noise_data, efficiency_data = load_scan(path)
+    except Exception as e:
+        print(f"Skip {path}: {str(e)}")
+        return None
+    with stage('sensitivity'):
+        table = opw_sensitivity(noise_data, efficiency_data, noise_cuts, efficiency_cuts, log_noise)
+    info = scan_info(path)
+    table.insert(0, 'ABCs', info['ABCs'])
+    table.insert(0, 'scan', info['scan'])
+    table.insert(0, 'sensor', info['sensor'])
+    return table
+
+def find_workbooks(root):
+    workbooks = []
+    with stage('discover'):
+        for dirpath, _, filenames in os.walk(root):
+            for name in filenames:
+                if name.endswith('.xlsx') and not name.startswith('~$'):   # skip Excel lock files
+                    workbooks.append(os.path.join(dirpath, name))
+    return sorted(workbooks)
+
+def resolve_workers(workers):
+    # None (the --workers default), 0 or negative: every core; unlike the Thermal Cycle scripts,
+    # where an unset --workers means a single process
+    if workers is None or workers <= 0:
+        return os.cpu_count() or 1
+    return workers
+
+def map_workbooks(func, workbooks, workers=None):
+    workers = resolve_workers(workers)
+    if workers == 1:
+        return [func(path) for path in workbooks]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(func, workbooks))
+
+def convert_workbooks(root, workers=None):
+    workbooks = find_workbooks(root)
+    map_workbooks(read_scan_sheet, workbooks, workers)
+    return workbooks
+
+def batch_opw(root, workers=None, plot_dir=None):
+    workbooks = find_workbooks(root)
+    if plot_dir is not None:
+        os.makedirs(plot_dir, exist_ok=True)
+    analyse = partial(analyse_workbook_safe, plot_dir=plot_dir)
+    return pd.DataFrame(map_workbooks(analyse, workbooks, workers))
+
+def batch_sensitivity(root, noise_cuts, efficiency_cuts, workers=None, log_noise=False):
+    workbooks = find_workbooks(root)
+    sensitivity = partial(workbook_sensitivity, noise_cuts=noise_cuts,
+                          efficiency_cuts=efficiency_cuts, log_noise=log_noise)
+    tables = map_workbooks(sensitivity, workbooks, workers)
+    tables = [table for table in tables if table is not None]
+    return pd.concat(tables, ignore_index=True) if tables else pd.DataFrame()
+
+def load_scan_safe(path):
+    try:
+        return load_scan(path)
+    except Exception as e:
+        print(f"Skip {path}: {str(e)}")
+        return None
+
+def fit_workbooks(root, workers=None):
+    # S-curve fits of every workbook under root, all scans fitted together
+    workbooks = find_workbooks(root)
+    scans = map_workbooks(load_scan_safe, workbooks, workers)
+    loaded = [(path, scan) for path, scan in zip(workbooks, scans) if scan is not None]
+    if not loaded:
+        return pd.DataFrame()
+
+    with stage('fit'):
+        table = fit_scans([scan for _, scan in loaded], NOISE_CUTOFF, EFFICIENCY_CUTOFF)
+    info = [scan_info(path) for path, _ in loaded]
+    table.insert(0, 'ABCs', [i['ABCs'] for i in info])
+    table.insert(0, 'scan', [i['scan'] for i in info])
+    table.insert(0, 'sensor', [i['sensor'] for i in info])
+    table.insert(0, 'workbook', [path for path, _ in loaded])
+    return table
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Operating window of threshold scans")
+    parser.add_argument('--batch', metavar='ROOT', default=None,
+                        help="analyse every scan workbook under ROOT instead of the default workbook")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="worker processes for --batch and --convert (default or 0: all cores)")
+    parser.add_argument('--convert', metavar='ROOT', default=None,
+                        help="only pre-convert every scan workbook under ROOT into the cache")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="always parse the workbooks with openpyxl")
+    parser.add_argument('--cache-dir', default=None,
+                        help="location of the converted workbooks")
+    parser.add_argument('--plots', metavar='DIR', default=None,
+                        help="also save one OPW plot per workbook into DIR")
+    parser.add_argument('--summary', default='opw_summary.csv',
+                        help="summary table written by --batch")
+    parser.add_argument('--sensitivity', metavar='FILE', default=None,
+                        help="with --batch, also write the OPW width for every pair of cuts below")
+    parser.add_argument('--noise-cuts', default='1e-3',
+                        help="comma-separated noise occupancy cuts for --sensitivity")
+    parser.add_argument('--efficiency-cuts', default='99',
+                        help="comma-separated efficiency cuts (%%) for --sensitivity")
+    parser.add_argument('--fit', metavar='FILE', default=None,
+                        help="with --batch, also fit erfc S-curves to every scan and write the results")
+    parser.add_argument('--log-noise', action='store_true',
+                        help="interpolate noise occupancy linearly in log10 for --sensitivity")
+    add_profile_args(parser)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.no_cache:
+        os.environ['OPW_CACHE'] = '0'
+    if args.cache_dir:
+        os.environ['OPW_CACHE_DIR'] = args.cache_dir     # inherited by the worker processes
+    start_profiling(args)
+    try:
+        run(args)
+    finally:
+        finish_profiling()
+
+def run(args):
+
+    if args.convert is not None:
+        workbooks = convert_workbooks(args.convert, workers=args.workers)
+        print(f"{len(workbooks)} workbooks converted")
+        return
+
+    if args.batch is None:
+        noise_data, efficiency_data = load_scan(DEFAULT_WORKBOOK)
+        with stage('operating_window'):
+            noise_cutoff, efficiency_cutoff = operating_window(noise_data, efficiency_data)
+        if noise_cutoff is None or efficiency_cutoff is None:
+            print("Warning: no valid OPW")
+        with stage('plot'):
+            plot_opw(noise_data, efficiency_data, noise_cutoff, efficiency_cutoff,
+                     f'{BEAM_INFO}, R3_39_s27, ABC: 0,1', 'R3_39_s27_0_1.png')
+        if valid_window(noise_cutoff, efficiency_cutoff):
+            print(f'OPW range: [{noise_cutoff:.1f}, {efficiency_cutoff:.1f}] DAC')
+            print(f'OPW width: {efficiency_cutoff - noise_cutoff:.1f} DAC')
+        else:
+            print("Warning: no valid operating window, noise threshold higher than efficiency threshold")
+        return
+
+    with stage('batch'):
+        summary = batch_opw(args.batch, workers=args.workers, plot_dir=args.plots)
+    if summary.empty:
+        print(f"No scan workbook found under {args.batch}")
+        return
+    summary.to_csv(args.summary, index=False)
+    print(summary.to_string(index=False))
+    print(f"Summary saved: {args.summary}")
+
+    if args.sensitivity:
+        noise_cuts = [float(cut) for cut in args.noise_cuts.split(',')]
+        efficiency_cuts = [float(cut) for cut in args.efficiency_cuts.split(',')]
+        table = batch_sensitivity(args.batch, noise_cuts, efficiency_cuts,
+                                  workers=args.workers, log_noise=args.log_noise)
+        table.to_csv(args.sensitivity, index=False)
+        print(f"Sensitivity table saved: {args.sensitivity}")
+
+    if args.fit:
+        fit_workbooks(args.batch, workers=args.workers).to_csv(args.fit, index=False)
+        print(f"S-curve fits saved: {args.fit}")
 
-plt.savefig('R3_39_s27_0_1.png')
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+# Stage profiler for the scripts in this directory. 'Thermal Cycle/profiling.py' holds the same code so that each
+# directory stays runnable on its own; change both files together.
+import os
+import json
+import time
+import threading
+import cProfile
+import pstats
+from contextlib import contextmanager
+
+SAMPLE_INTERVAL = 0.05
+
+def current_rss():
+    # resident memory of this process in bytes, None where /proc is not available
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+class Profiler:
+    # nested stage timers ('ingest/load'), counters and per-stage peak memory, off unless enabled
+    def __init__(self):
+        self.enabled = False
+        self.stages = {}
+        self.counters = {}
+        self.events = []
+        self.open_frames = []
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter()
+        self.trace_path = None
+        self.cprofile_stage = None
+        self.cprofile = None
+        self.cprofiling = False
+        self.sampler = None
+
+    def enable(self, trace_path=None, cprofile_stage=None):
+        self.enabled = True
+        self.trace_path = trace_path
+        self.cprofile_stage = cprofile_stage
+        self.origin = time.perf_counter()
+        if current_rss() is not None and self.sampler is None:
+            self.sampler = threading.Thread(target=self.sample_memory, daemon=True)
+            self.sampler.start()
+
+    def sample_memory(self):
+        while self.enabled:
+            rss = current_rss()
+            with self.lock:
+                for frame in self.open_frames:
+                    frame['peak'] = max(frame['peak'], rss)
+            time.sleep(SAMPLE_INTERVAL)
+
+    @contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield
+            return
+
+        stack = self.local.__dict__.setdefault('stack', [])
+        path = '/'.join(stack + [name])
+        rss = current_rss() or 0
+        frame = {'peak': rss}
+        profile = None
+        # every call of the chosen stage in the main thread goes into one profile
+        if (name == self.cprofile_stage and not self.cprofiling
+                and threading.current_thread() is threading.main_thread()):
+            if self.cprofile is None:
+                self.cprofile = cProfile.Profile()
+            profile = self.cprofile
+            self.cprofiling = True
+        with self.lock:
+            self.open_frames.append(frame)
+            # created on entry so that the report lists stages in the order they started
+            entry = self.stages.setdefault(path, {'calls': 0, 'seconds': 0.0, 'peak_rss': 0})
+        stack.append(name)
+        start = time.perf_counter()
+        try:
+            if profile is None:
+                yield
+            else:
+                profile.enable()
+                try:
+                    yield
+                finally:
+                    profile.disable()
+                    self.cprofiling = False
+        finally:
+            end = time.perf_counter()
+            stack.pop()
+            with self.lock:
+                self.open_frames = [open_frame for open_frame in self.open_frames if open_frame is not frame]
+                peak = max(frame['peak'], current_rss() or 0)
+                entry['calls'] += 1
+                entry['seconds'] += end - start
+                entry['peak_rss'] = max(entry['peak_rss'], peak)
+                self.events.append({'name': path, 'ph': 'X', 'pid': os.getpid(),
+                                    'tid': threading.get_ident(),
+                                    'ts': (start - self.origin) * 1e6, 'dur': (end - start) * 1e6,
+                                    'args': {'peak_rss_mb': round(peak / 1e6, 1)}})
+
+    def count(self, name, amount=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def report(self):
+        top_level = sum(entry['seconds'] for path, entry in self.stages.items() if '/' not in path)
+        print(f"\n{'stage':44s} {'calls':>7s} {'seconds':>9s} {'share':>6s} {'peak MB':>8s}")
+        for path, entry in self.stages.items():
+            depth = path.count('/')
+            label = '  ' * depth + path.rsplit('/', 1)[-1]
+            share = 100 * entry['seconds'] / top_level if top_level else 0.0
+            peak = f"{entry['peak_rss'] / 1e6:8.1f}" if entry['peak_rss'] else '     n/a'
+            print(f"{label:44s} {entry['calls']:7d} {entry['seconds']:9.3f} {share:5.1f}% {peak}")
+        # counters of process-pool workers are not collected, use --threads or one worker for exact numbers
+        for name, value in sorted(self.counters.items()):
+            if name.endswith('bytes'):
+                print(f"{name:44s} {value / 1e6:14.1f} MB")
+            else:
+                print(f"{name:44s} {value:14d}")
+
+    def finish(self):
+        if not self.enabled:
+            return
+        self.enabled = False
+        self.sampler = None
+        self.report()
+        if self.trace_path:
+            with open(self.trace_path, 'w') as f:
+                json.dump({'traceEvents': self.events, 'counters': self.counters,
+                           'stages': self.stages}, f)
+            print(f"Trace saved to: {self.trace_path} (chrome://tracing or Perfetto format)")
+        if self.cprofile is not None:
+            output = f"{self.cprofile_stage}.prof"
+            self.cprofile.dump_stats(output)
+            print(f"\ncProfile of stage '{self.cprofile_stage}' saved to: {output}")
+            pstats.Stats(self.cprofile).sort_stats('cumulative').print_stats(20)
+
+profiler = Profiler()
+stage = profiler.stage
+count = profiler.count
+
+def add_profile_args(parser):
+    parser.add_argument('--profile', action='store_true',
+                        help="print a per-stage timing, counter and peak-memory report")
+    parser.add_argument('--profile-trace', default=None, metavar='FILE',
+                        help="also write the stage timings as a JSON trace (implies --profile)")
+    parser.add_argument('--profile-stage', default=None, metavar='STAGE',
+                        help="capture cProfile statistics of one stage, e.g. 'load' (implies --profile)")
+
+def start_profiling(args):
+    if args.profile or args.profile_trace or args.profile_stage:
+        profiler.enable(args.profile_trace, args.profile_stage)
+
+def finish_profiling():
+    profiler.finish()
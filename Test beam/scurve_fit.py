@@ -0,0 +1,219 @@
+import numpy as np
+import pandas as pd
+
+SQRT2 = np.sqrt(2.0)
+SQRT_PI = np.sqrt(np.pi)
+
+# Numerical Recipes erfcc coefficients, fractional error below 1.2e-7
+ERFC_COEFFS = (-1.26551223, 1.00002368, 0.37409196, 0.09678418, -0.18628806,
+               0.27886807, -1.13520398, 1.48851587, -0.82215223, 0.17087277)
+# Acklam's rational approximation of the standard normal quantile
+QUANTILE_A = (-3.969683028665376e+01, 2.209460984245205e+02, -2.759285104469687e+02,
+              1.383577518672690e+02, -3.066479806614716e+01, 2.506628277459239e+00)
+QUANTILE_B = (-5.447609879822406e+01, 1.615858368580409e+02, -1.556989798598866e+02,
+              6.680131188771972e+01, -1.328068155288572e+01, 1.0)
+QUANTILE_C = (-7.784894002430293e-03, -3.223964580411365e-01, -2.400758277161838e+00,
+              -2.549732539343734e+00, 4.374664141464968e+00, 2.938163982698783e+00)
+QUANTILE_D = (7.784695709041462e-03, 3.224671290700398e-01, 2.445134137142996e+00,
+              3.754408361186543e+00, 1.0)
+
+def polyval(coeffs, x):
+    result = np.zeros_like(x)
+    for coeff in coeffs:
+        result = result * x + coeff
+    return result
+
+def erfc_terms(x):
+    # erfc(x), log(erfc(x)) and exp(-x**2)/erfc(x), stable far into the tail
+    z = np.abs(x)
+    t = 1.0 / (1.0 + 0.5 * z)
+    poly = polyval(ERFC_COEFFS[::-1], t)
+    log_tail = np.log(t) - z * z + poly
+    tail = np.exp(log_tail)
+    positive = x >= 0
+    erfc = np.where(positive, tail, 2.0 - tail)
+    log_erfc = np.where(positive, log_tail, np.log(erfc))
+    ratio = np.where(positive, 1.0 / (t * np.exp(poly)), np.exp(-z * z) / erfc)
+    return erfc, log_erfc, ratio
+
+def normal_quantile(p):
+    p = np.clip(np.asarray(p, dtype=float), 1e-300, 1 - 1e-16)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        q = p - 0.5
+        r = q * q
+        central = polyval(QUANTILE_A, r) * q / polyval(QUANTILE_B, r)
+        q_low = np.sqrt(-2 * np.log(p))
+        lower = polyval(QUANTILE_C, q_low) / polyval(QUANTILE_D, q_low)
+        q_high = np.sqrt(-2 * np.log1p(-p))
+        upper = -polyval(QUANTILE_C, q_high) / polyval(QUANTILE_D, q_high)
+    return np.where(p < 0.02425, lower, np.where(p > 1 - 0.02425, upper, central))
+
+def efficiency_model(params, x):
+    # plateau/2 * erfc((x - median) / (sqrt(2) * width)) and its Jacobian
+    plateau, median, width = params[:, 0:1], params[:, 1:2], params[:, 2:3]
+    u = (x - median) / (SQRT2 * width)
+    erfc, _, _ = erfc_terms(u)
+    gauss = np.exp(-u * u) / (SQRT2 * SQRT_PI * width)
+    jacobian = np.stack([0.5 * erfc,
+                         plateau * gauss,
+                         plateau * gauss * (x - median) / width], axis=-1)
+    return 0.5 * plateau * erfc, jacobian
+
+def log_noise_model(params, x):
+    # log of the Gaussian tail 1/2 * erfc((x - baseline) / (sqrt(2) * noise)) and its Jacobian
+    baseline, noise = params[:, 0:1], params[:, 1:2]
+    v = (x - baseline) / (SQRT2 * noise)
+    _, log_erfc, ratio = erfc_terms(v)
+    dlog_dv = -2.0 / SQRT_PI * ratio
+    jacobian = np.stack([-dlog_dv / (SQRT2 * noise),
+                         -dlog_dv * v / noise], axis=-1)
+    return log_erfc - np.log(2.0), jacobian
+
+def levenberg_marquardt(model, params, x, y, mask, lower=None, max_iter=200, tol=1e-10):
+    # damped Gauss-Newton on every scan at once; rows of x/y are scans, padded where mask is False
+    params = np.array(params, dtype=float)
+    n_scans, n_params = params.shape
+    weight = mask.astype(float)
+    diag_idx = np.arange(n_params)
+
+    def evaluate(p):
+        with np.errstate(all='ignore'):
+            f, jacobian = model(p, x)
+            residual = np.where(mask, f - y, 0.0)
+        return residual, jacobian * weight[..., None], (residual * residual).sum(axis=1)
+
+    residual, jacobian, cost = evaluate(params)
+    damping = np.full(n_scans, 1e-3)
+    active = np.isfinite(cost)
+    for _ in range(max_iter):
+        if not active.any():
+            break
+        jtj = np.einsum('snk,snl->skl', jacobian, jacobian)
+        gradient = np.einsum('snk,sn->sk', jacobian, residual)
+        system = jtj.copy()
+        system[:, diag_idx, diag_idx] += damping[:, None] * jtj[:, diag_idx, diag_idx] + 1e-12
+        system[~active] = np.eye(n_params)
+        gradient[~active] = 0.0
+        try:
+            step = np.linalg.solve(system, -gradient[..., None])[..., 0]
+        except np.linalg.LinAlgError:
+            step = np.einsum('skl,sl->sk', np.linalg.pinv(system), -gradient)
+
+        trial = params + step
+        if lower is not None:
+            trial = np.maximum(trial, lower)
+        trial_residual, trial_jacobian, trial_cost = evaluate(trial)
+        better = active & np.isfinite(trial_cost) & (trial_cost < cost)
+
+        converged = better & (cost - trial_cost <= tol * np.maximum(cost, 1e-300))
+        params[better] = trial[better]
+        residual[better] = trial_residual[better]
+        jacobian[better] = trial_jacobian[better]
+        cost = np.where(better, trial_cost, cost)
+        damping = np.where(better, damping / 10, damping * 10)
+        active &= ~converged & (damping < 1e12)
+
+    n_points = mask.sum(axis=1)
+    dof = np.maximum(n_points - n_params, 1)
+    jtj = np.einsum('snk,snl->skl', jacobian, jacobian)
+    covariance = np.linalg.pinv(jtj) * (cost / dof)[:, None, None]
+    errors = np.sqrt(np.abs(covariance[:, diag_idx, diag_idx]))
+    failed = (n_points <= n_params) | ~np.isfinite(cost)
+    params[failed] = np.nan
+    errors[failed] = np.nan
+    return params, errors, covariance
+
+def linear_guess(x, z, mask):
+    # least-squares x = offset + slope * z per row over the masked points
+    w = mask.astype(float)
+    n = np.maximum(w.sum(axis=1), 1)
+    x_mean = (w * x).sum(axis=1) / n
+    z_mean = (w * z).sum(axis=1) / n
+    var_z = (w * (z - z_mean[:, None]) ** 2).sum(axis=1)
+    cov = (w * (z - z_mean[:, None]) * (x - x_mean[:, None])).sum(axis=1)
+    slope = np.where(var_z > 0, cov / np.where(var_z > 0, var_z, 1), np.nan)
+    return x_mean - slope * z_mean, slope
+
+def stack_curves(curves):
+    # list of (x, y) arrays -> zero-padded (scans x points) arrays and validity mask
+    n_points = max((len(x) for x, _ in curves), default=0)
+    x = np.zeros((len(curves), n_points))
+    y = np.zeros((len(curves), n_points))
+    mask = np.zeros((len(curves), n_points), dtype=bool)
+    for i, (cx, cy) in enumerate(curves):
+        cx = np.asarray(cx, dtype=float)
+        cy = np.asarray(cy, dtype=float)
+        x[i, :len(cx)] = cx
+        y[i, :len(cy)] = cy
+        mask[i, :len(cx)] = np.isfinite(cx) & np.isfinite(cy)
+    return x, y, mask
+
+def fit_efficiency(x, y, mask, max_iter=200):
+    # params per scan: plateau (%), median threshold, width (DAC)
+    plateau = np.where(mask, y, -np.inf).max(axis=1)
+    plateau = np.where(np.isfinite(plateau), plateau, 100.0)
+    fraction = y / np.where(plateau > 0, plateau, 1)[:, None]
+    usable = mask & (fraction > 0.05) & (fraction < 0.95)
+    median, width = linear_guess(x, normal_quantile(1 - fraction), usable)
+    span = np.where(mask, x, np.nan)
+    with np.errstate(all='ignore'):
+        median = np.where(np.isfinite(median), median, np.nanmedian(span, axis=1))
+        default_width = (np.nanmax(span, axis=1) - np.nanmin(span, axis=1)) / 10
+    width = np.where(np.isfinite(width) & (width > 0), width, np.maximum(default_width, 1.0))
+    start = np.stack([plateau, median, width], axis=1)
+    lower = np.array([0.0, -np.inf, 1e-6])
+    return levenberg_marquardt(efficiency_model, start, x, y, mask, lower, max_iter)
+
+def fit_noise(x, occupancy, mask, max_iter=200):
+    # params per scan: baseline, noise (DAC); fitted in log(occupancy)
+    mask = mask & (occupancy > 0)
+    log_occupancy = np.log(np.where(mask, occupancy, 1.0))
+    usable = mask & (occupancy < 0.5)
+    baseline, noise = linear_guess(x, -normal_quantile(np.where(usable, occupancy, 0.25)), usable)
+    baseline = np.where(np.isfinite(baseline), baseline, 0.0)
+    noise = np.where(np.isfinite(noise) & (noise > 0), noise, 10.0)
+    start = np.stack([baseline, noise], axis=1)
+    lower = np.array([-np.inf, 1e-6])
+    return levenberg_marquardt(log_noise_model, start, x, log_occupancy, mask, lower, max_iter)
+
+def fitted_window(eff_params, eff_cov, noise_params, noise_cov, noise_cut=1e-3, efficiency_cut=99):
+    # thresholds where the fitted curves cross the cuts, with linearly propagated errors
+    z_noise = -normal_quantile(noise_cut)
+    low = noise_params[:, 0] + z_noise * noise_params[:, 1]
+    grad_low = np.stack([np.ones_like(low), np.full_like(low, z_noise)], axis=1)
+    low_err = np.sqrt(np.einsum('sk,skl,sl->s', grad_low, noise_cov, grad_low))
+
+    plateau, median, width = eff_params[:, 0], eff_params[:, 1], eff_params[:, 2]
+    with np.errstate(all='ignore'):
+        reachable = plateau > efficiency_cut
+        q = normal_quantile(1 - efficiency_cut / np.where(reachable, plateau, 1))
+        high = np.where(reachable, median + width * q, np.nan)
+        density = np.exp(-0.5 * q * q) / np.sqrt(2 * np.pi)
+        dq_dplateau = efficiency_cut / plateau ** 2 / density
+        grad_high = np.stack([width * dq_dplateau, np.ones_like(high), q], axis=1)
+        high_err = np.sqrt(np.einsum('sk,skl,sl->s', grad_high, eff_cov, grad_high))
+    high_err = np.where(reachable, high_err, np.nan)
+    return low, low_err, high, high_err
+
+def fit_scans(scans, noise_cut=1e-3, efficiency_cut=99):
+    # scans: list of (noise_data, efficiency_data) frames as returned by OPW.load_scan
+    noise_x, noise_y, noise_mask = stack_curves(
+        [(noise['Threshold'], noise['NoiseOccupancy']) for noise, _ in scans])
+    eff_x, eff_y, eff_mask = stack_curves(
+        [(efficiency['Threshold'], efficiency['Efficiency']) for _, efficiency in scans])
+
+    eff_params, eff_errors, eff_cov = fit_efficiency(eff_x, eff_y, eff_mask)
+    noise_params, noise_errors, noise_cov = fit_noise(noise_x, noise_y, noise_mask)
+    low, low_err, high, high_err = fitted_window(eff_params, eff_cov, noise_params, noise_cov,
+                                                 noise_cut, efficiency_cut)
+    width = np.where(high > low, high - low, np.nan)
+    return pd.DataFrame({
+        'plateau': eff_params[:, 0], 'plateau_err': eff_errors[:, 0],
+        'median': eff_params[:, 1], 'median_err': eff_errors[:, 1],
+        'eff_width': eff_params[:, 2], 'eff_width_err': eff_errors[:, 2],
+        'baseline': noise_params[:, 0], 'baseline_err': noise_errors[:, 0],
+        'noise': noise_params[:, 1], 'noise_err': noise_errors[:, 1],
+        'opw_low': low, 'opw_low_err': low_err,
+        'opw_high': high, 'opw_high_err': high_err,
+        'opw_width': width, 'opw_width_err': np.where(np.isfinite(width), np.hypot(low_err, high_err), np.nan)
+    })
@@ -0,0 +1,141 @@
+import os
+import io
+import json
+import time
+import argparse
+import tempfile
+import contextlib
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from result_cache import configure
+from synthetic_data import generate
+from channel_analysis_type import process_type_analysis, create_module_level_plots
+from chip_analysis import collect_chip_data
+from boxplot import boxplot_jobs, plot_boxplot, find_json
+
+TYPE_NAME = 'TYPEA'
+
+def timed(func, *args, **kwargs):
+    # the scripts report every file they read, keep that out of the benchmark output
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+def dataset(data_dir, modules, seed):
+    root = os.path.join(data_dir, f"modules_{modules}")
+    if not os.path.isdir(os.path.join(root, TYPE_NAME)):
+        print(f"Generating {modules} modules in {root}...")
+        generate(root, modules, (TYPE_NAME,), seed=seed)
+    return root
+
+def bench_size(root, modules, render_limit, workers):
+    rows = []
+    type_dir = os.path.join(root, TYPE_NAME)
+
+    seconds, all_data = timed(process_type_analysis, root, TYPE_NAME, workers=workers)
+    rows.append(('ingest process_type_analysis', modules, seconds))
+    seconds, _ = timed(collect_chip_data, type_dir, 0, workers=workers)
+    rows.append(('ingest collect_chip_data', modules, seconds))
+
+    seconds, figures = timed(create_module_level_plots, TYPE_NAME, all_data)
+    rows.append(('aggregate create_module_level_plots', modules, seconds))
+    for fig in figures:
+        if fig:
+            plt.close(fig)
+
+    # rendering is per file: a fixed number of figures, reported per figure
+    with tempfile.TemporaryDirectory() as out_dir:
+        _, files = timed(find_json, type_dir, '')
+        files = sorted(files)[:render_limit]
+        _, jobs = timed(lambda: list(boxplot_jobs(files, ['results', '0', 'value'], '0')))
+        seconds = 0.0
+        for job in jobs:
+            plot_data, temps, full_path, *rest = job
+            job_seconds, _ = timed(plot_boxplot, plot_data, temps,
+                                   os.path.join(out_dir, os.path.basename(full_path)), *rest)
+            seconds += job_seconds
+        if jobs:
+            rows.append(('render plot_boxplot (per figure)', modules, seconds / len(jobs)))
+    return rows
+
+def scaling_report(rows, tolerance):
+    # time per module relative to the smallest size: growth beyond tolerance means worse than linear
+    flagged = []
+    stages = {}
+    for stage, modules, seconds in rows:
+        stages.setdefault(stage, []).append((modules, seconds))
+    for stage, points in stages.items():
+        if 'per figure' in stage or len(points) < 2:
+            continue
+        points.sort()
+        base = points[0][1] / points[0][0]
+        for modules, seconds in points[1:]:
+            ratio = (seconds / modules) / base if base > 0 else 0.0
+            if ratio > tolerance:
+                flagged.append(f"{stage}: {ratio:.2f}x time per module at {modules} modules")
+    return flagged
+
+def regression_report(rows, baseline_path, tolerance):
+    with open(baseline_path, 'r') as f:
+        baseline = {(row['stage'], row['modules']): row['seconds'] for row in json.load(f)['rows']}
+    flagged = []
+    for stage, modules, seconds in rows:
+        before = baseline.get((stage, modules))
+        if before and seconds > tolerance * before:
+            flagged.append(f"{stage} at {modules} modules: {before:.3f} s -> {seconds:.3f} s")
+    return flagged
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Time ingestion, aggregation and rendering on synthetic data")
+    parser.add_argument('--sizes', default='10,100,1000',
+                        help="comma separated numbers of modules (about 1.7 MB of JSON per module)")
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'thermal_cycle_bench'),
+                        help="where the synthetic datasets are generated and kept between runs")
+    parser.add_argument('--render-limit', type=int, default=5,
+                        help="number of boxplot figures rendered per size")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="workers passed to the ingestion functions (0: all cores)")
+    parser.add_argument('--cache', action='store_true',
+                        help="keep the parsed-result cache on (warm runs after the first)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None,
+                        help="write the timings as JSON, usable as a later --baseline")
+    parser.add_argument('--baseline', default=None,
+                        help="JSON from an earlier run; stages slower than --tolerance times it are reported")
+    parser.add_argument('--tolerance', type=float, default=1.5)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    configure(enabled=args.cache, cache_dir=os.path.join(args.data_dir, 'cache'))
+    sizes = [int(size) for size in args.sizes.split(',') if size.strip()]
+
+    rows = []
+    for modules in sizes:
+        root = dataset(args.data_dir, modules, args.seed)
+        rows.extend(bench_size(root, modules, args.render_limit, args.workers))
+
+    print(f"\n{'stage':40s} {'modules':>8s} {'seconds':>10s} {'ms/module':>10s}")
+    for stage, modules, seconds in rows:
+        per_module = '' if 'per figure' in stage else f"{1000 * seconds / modules:10.2f}"
+        print(f"{stage:40s} {modules:8d} {seconds:10.3f} {per_module:>10s}")
+
+    flagged = scaling_report(rows, args.tolerance)
+    if args.baseline:
+        flagged += regression_report(rows, args.baseline, args.tolerance)
+    if flagged:
+        print("\nPossible regressions:")
+        for line in flagged:
+            print(f"  {line}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'sizes': sizes, 'cache': args.cache, 'workers': args.workers,
+                       'rows': [{'stage': stage, 'modules': modules, 'seconds': seconds}
+                                for stage, modules, seconds in rows]}, f, indent=1)
+        print(f"\nTimings saved to: {args.output}")
+
+if __name__ == "__main__":
+    main()
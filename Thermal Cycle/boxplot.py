@@ -1,11 +1,21 @@
 import os
-import json
+import atexit
+import argparse
 import matplotlib.pyplot as plt
 from matplotlib.patches import Patch
 from matplotlib.lines import Line2D    
 import numpy as np
 import re
-from typing import List, Any
+from functools import partial
+from typing import List, Any, Optional
+from result_cache import load_test_run, prune_cache
+from parallel import ordered_map, read_ahead
+from dir_index import load_directory_index, find_serial_files, split_type_dir
+from catalog import add_filter_args, filters_from_args, filter_files
+from profiling import stage, add_profile_args, start_profiling, finish_profiling
+from json_backend import compare_backends
+from ingest import add_ingest_args, apply_ingest_args
+from draft import save_options, figure_path, record_inputs, add_draft_args
 
 def nested_value(data: dict, path: list) -> Any:       #decode the path of info
     current = data
@@ -39,28 +49,20 @@ def find_json(input_type: str, input_sn: str) -> List[str]:
         path = os.path.join(input_type, input_sn)
         print(f"Find the accurate path:{path}")
         if os.path.exists(path):
-            json_files = [os.path.join(path, f) for f in os.listdir(path) 
-                         if f.endswith('.json')]
+            root, type_name = split_type_dir(input_type)
+            json_files = find_serial_files(root, input_sn, type_name)
     
     # input Type
     elif input_type:
         type_dir = input_type
         if os.path.exists(type_dir):
-            for sn in os.listdir(type_dir):
-                sn_path = os.path.join(type_dir, sn)
-                if os.path.isdir(sn_path):
-                    json_files.extend([os.path.join(sn_path, f) for f in os.listdir(sn_path)
-                                     if f.endswith('.json')])
+            root, type_name = split_type_dir(type_dir)
+            json_files = load_directory_index(root, [type_name]).files(type_name)
     
     # input SerialNumber
     elif input_sn:
         print(f"Scan Type directory: {input_type}")
-        for type_dir in os.listdir('.'):
-            if os.path.isdir(type_dir):
-                sn_path = os.path.join(type_dir, input_sn)
-                if os.path.exists(sn_path):
-                    json_files.extend([os.path.join(sn_path, f) for f in os.listdir(sn_path)
-                                     if f.endswith('.json')])
+        json_files = find_serial_files(sn=input_sn)
     
     return json_files
 
@@ -133,7 +135,7 @@ def failed_indices(data: dict) -> list:
     failed_tests = nested_value(data, ['properties', '3', 'value', 'failed_tests']) or []
     return [i+1 for i, t in enumerate(all_tests) if t in failed_tests]  
 
-def plot_boxplot(data: list, temps: list, save_path: str, result_name: str, info_lines: tuple, yname: str, failed_indices: list):
+def plot_boxplot(data: list, temps: list, save_path: str, result_name: str, info_lines: tuple, yname: str, failed_indices: list, draft: Optional[str] = None):
     plt.figure(figsize=(12, 8))
     ax = plt.gca()
 
@@ -222,49 +224,237 @@ def plot_boxplot(data: list, temps: list, save_path: str, result_name: str, info
                 fontsize=8)
     
     plt.grid(True, linestyle='--', alpha=0.6, axis='y')
-    plt.savefig(save_path, dpi=300, bbox_inches='tight')
+    with stage('savefig'):
+        plt.savefig(save_path, **save_options(draft))
     plt.close()
     print(f"Figure saved：{save_path}")
 
-def main():
+def box_statistics(data: list, whis: float = 1.5) -> list:
+    # same statistics as plt.boxplot, from one np.percentile call when every test has the same length
+    if len({len(test_data) for test_data in data}) != 1:
+        return [stats for test_data in data for stats in box_statistics([test_data], whis)]
+
+    values = np.asarray(data, dtype=float)
+    q1, med, q3 = np.percentile(values, [25, 50, 75], axis=1)
+    iqr = q3 - q1
+    inner_hi = np.where(values <= (q3 + whis * iqr)[:, None], values, -np.inf).max(axis=1)
+    inner_lo = np.where(values >= (q1 - whis * iqr)[:, None], values, np.inf).min(axis=1)
+    whishi = np.where(inner_hi < q3, q3, inner_hi)
+    whislo = np.where(inner_lo > q1, q1, inner_lo)
+    return [{
+        'med': med[i], 'q1': q1[i], 'q3': q3[i],
+        'whislo': whislo[i], 'whishi': whishi[i],
+        'fliers': values[i][(values[i] < whislo[i]) | (values[i] > whishi[i])]
+    } for i in range(len(values))]
+
+class BoxplotTemplate:
+    # one figure whose static artists (legend, ticks, grid, labels) are kept between modules
+    def __init__(self):
+        self.fig, self.ax = plt.subplots(figsize=(12, 8))
+        legend_elements = [
+            Patch(facecolor='#CC7306', edgecolor='#2D4059', label='Warm Test (T > 0℃)'),
+            Patch(facecolor='#4D96FF', edgecolor='#2D4059', label='Cold Test (T < 0℃)'),
+            Patch(facecolor='white', edgecolor='black', hatch='////', label='Failed Test'),
+            Line2D([0], [0], marker='^',color='w',markerfacecolor='#2A9D8F',markersize=15,label='Shunted Tests')
+        ]
+        self.ax.legend(handles=legend_elements, loc='upper right', fontsize=12)
+        self.ax.set_xlabel('Test Sequence', fontsize=14)
+        self.ax.set_xticks(range(1, 26), [f"T{i:02d}" for i in range(1, 26)])
+        self.ax.grid(True, linestyle='--', alpha=0.6, axis='y')
+        self.artists = []
+
+    def clear(self):
+        for artist in self.artists:
+            artist.remove()
+        self.artists = []
+
+    def render(self, data: list, temps: list, save_path: str, result_name: str, info_lines: tuple, yname: str, failed_indices: list, draft: Optional[str] = None):
+        ax = self.ax
+        self.clear()
+
+        colors = ['#CC7306' if t > 0 else '#4D96FF' for t in temps[:len(data)]]
+        box = ax.bxp(box_statistics(data),
+                     positions=range(1, len(data) + 1),
+                     patch_artist=True,
+                     showfliers=False,
+                     widths=0.7,
+                     manage_ticks=False)
+        self.artists.extend(artist for artists in box.values() for artist in artists)
+        for patch, color in zip(box['boxes'], colors):
+            patch.set_facecolor(color)
+            patch.set_edgecolor('black')
+        for element in ['whiskers', 'caps', 'medians']:
+            plt.setp(box[element], color='#2D4059', linewidth=1.5)
+        for i, (patch, median_line) in enumerate(zip(box['boxes'], box['medians'])):
+            if (i+1) in failed_indices:
+                patch.set_hatch('////')
+                patch.set_edgecolor('black')
+                median_line.set_linewidth(3)
+
+        # limits as plt.boxplot leaves them: x pinned to the boxes, y autoscaled on the boxes only
+        ax.set_xlim(0.5, len(data) + 0.5)
+        ax.relim()
+        ax.set_autoscaley_on(True)
+        ax.autoscale_view(scalex=False)
+        y_min, y_max = ax.get_ylim()
+
+        for test_num in [3, 23]:
+            idx = test_num - 1
+            if idx >= len(data):
+                continue
+            x = box['medians'][idx].get_xdata()[1]
+            self.artists.append(ax.scatter(x - 0.35, y_min + 1,
+                                           marker='^',
+                                           s=200,
+                                           color='#2A9D8F',
+                                           edgecolors='black',
+                                           zorder=4))
+
+        text_params = {
+            'fontsize': 12,
+            'ha': 'left',
+            'va': 'bottom',
+            'bbox': dict(boxstyle='round', facecolor='white', alpha=0.9, edgecolor='lightgray'),
+            'linespacing': 1.5
+        }
+        base_y = y_max + 0.1*(y_max - y_min)
+        for i, line in enumerate(info_lines[:3]):
+            self.artists.append(ax.text(0.8, base_y - 0.06*i*(y_max - y_min), line, **text_params))
+        new_ymax = base_y + 0.05*(y_max - y_min)
+        ax.set_ylim(y_min, max(y_max, new_ymax))
+
+        ax.set_title(f"Thermal Cycle Analysis: {result_name}", fontsize=16, pad=1, y=1.02)
+        ax.set_ylabel(f"{yname}", fontsize=14)
+        for i, test_data in enumerate(data):
+            median = np.median(test_data)
+            self.artists.append(ax.text(i+1, median, f'{median:.2f}',
+                                        horizontalalignment='center',
+                                        fontsize=8))
+
+        with stage('savefig'):
+            self.fig.savefig(save_path, **save_options(draft))
+        print(f"Figure saved：{save_path}")
+
+    def close(self):
+        plt.close(self.fig)
+
+boxplot_template = None
+
+def template_plot_boxplot(*args, **kwargs):
+    # per-process template, created on first use and closed when the process exits (pool workers included)
+    global boxplot_template
+    if boxplot_template is None:
+        boxplot_template = BoxplotTemplate()
+        atexit.register(close_boxplot_template)
+    boxplot_template.render(*args, **kwargs)
+
+def close_boxplot_template():
+    global boxplot_template
+    if boxplot_template is not None:
+        boxplot_template.close()
+        boxplot_template = None
+
+def boxplot_jobs(files: List[str], base_path: list, input_num: str):
+    # data extraction stays in the main process, only plot_boxplot arguments reach the workers;
+    # upcoming files are read ahead while the current one is extracted
+    loaded = read_ahead(partial(load_test_run, values=[int(input_num)]), files)
+    for file in files:
+        with stage('load'):
+            _, data, error = next(loaded)
+        if error is not None:
+            raise error
+        with stage('extract'):
+            plot_data = extract(data, base_path)
+            temps = temperature(data)
+            failed_index = failed_indices(data)
+        if not plot_data or len(temps) != 25:
+            print(f"File {file} data is invalid (doesn't have 25 tests)")
+            continue
+        result_name = get_result_name(data, input_num)
+        if result_name.startswith("gain"):
+            yname = "Gain (mV/fC)"
+        elif result_name.startswith("innse"):
+            yname = "Input noise (ENC)"
+        elif result_name.startswith("vt50"):
+            yname = "Vt50 (mV)"
+        base_name = os.path.splitext(os.path.basename(file))[0]
+        output_file = filename(base_name, result_name)
+        output_dir = os.path.join("plots", os.path.dirname(file))
+        os.makedirs(output_dir, exist_ok=True)
+        full_path = os.path.join(output_dir, output_file)
+        info_lines = info(data)
+        yield (plot_data, temps, full_path, result_name, info_lines, yname, failed_index)
+
+def record_boxplot_job(job: tuple):
+    plot_data, temps, full_path, result_name, info_lines, yname, failed_index = job
+    meta = {'result_name': result_name, 'info_lines': list(info_lines), 'yname': yname,
+            'failed_indices': failed_index}
+    arrays = {f"test{i}": np.asarray(test_data, dtype=float) for i, test_data in enumerate(plot_data)}
+    arrays['temps'] = np.asarray(temps, dtype=float)
+    record_inputs(full_path, 'boxplot', meta, arrays)
+
+def replay_boxplot(meta: dict, arrays: dict, save_path: str):
+    n_tests = len([name for name in arrays if name.startswith('test')])
+    plot_data = [arrays[f"test{i}"] for i in range(n_tests)]
+    plot_boxplot(plot_data, list(arrays['temps']), save_path, meta['result_name'], tuple(meta['info_lines']),
+                 meta['yname'], meta['failed_indices'])
+
+def render_boxplot_job(job: tuple, use_template: bool = False, draft: Optional[str] = None):
+    if boxplot_template is None:
+        plt.switch_backend('Agg')       # headless, also inside pool workers
+    plot_data, temps, full_path, result_name, info_lines, yname, failed_index = job
+    plot = template_plot_boxplot if use_template else plot_boxplot
+    if draft:
+        record_boxplot_job(job)
+    with stage('render'):
+        plot(plot_data, temps, figure_path(full_path, draft), result_name, info_lines, yname,
+             failed_indices=failed_index, draft=draft)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Per-file thermal cycle boxplots")
+    add_ingest_args(parser, workers_help="number of processes rendering figures (0: all cores)", threads=False)
+    parser.add_argument('--template', action='store_true',
+                        help="reuse one template figure per process instead of rebuilding every figure")
+    add_filter_args(parser)
+    add_draft_args(parser)
+    add_profile_args(parser)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    apply_ingest_args(args)
+    start_profiling(args)
     input_type = input("Input your Type (Press enter to skip): ").strip()
     input_sn = input("Input your SerialNumber (Press enter to skip): ").strip()
     data_path = input("Input the index of the data: ").strip()
     
     try:
         base_path, input_num = parse_data_path(data_path)
-        files = find_json(input_type, input_sn)
+        with stage('discover'):
+            files = find_json(input_type, input_sn)
         
         if not files:
             print("No matching JSON file found")
             return
+        if args.catalog:
+            files = filter_files(files, args.catalog, **filters_from_args(args))
+            print(f"{len(files)} files selected by the catalog")
+        if args.compare_json:
+            compare_backends(files)
         
-        for file in files:
-            with open(file, 'r') as f:
-                data = json.load(f)
-                plot_data = extract(data, base_path)
-                temps = temperature(data)
-                failed_index = failed_indices(data)
-                if not plot_data or len(temps) != 25:
-                    print(f"File {file} data is invalid (doesn't have 25 tests)")
-                    continue
-                result_name = get_result_name(data, input_num)
-                if result_name.startswith("gain"):
-                    yname = "Gain (mV/fC)"
-                elif result_name.startswith("innse"):
-                    yname = "Input noise (ENC)"
-                elif result_name.startswith("vt50"):
-                    yname = "Vt50 (mV)"
-                base_name = os.path.splitext(os.path.basename(file))[0]
-                output_file = filename(base_name, result_name)
-                output_dir = os.path.join("plots", os.path.dirname(file))
-                os.makedirs(output_dir, exist_ok=True)
-                full_path = os.path.join(output_dir, output_file)
-                info_lines = info(data)
-                plot_boxplot(plot_data, temps, full_path, result_name, info_lines, yname, failed_indices=failed_index)
+        jobs = boxplot_jobs(files, base_path, input_num)
+        render = partial(render_boxplot_job, use_template=args.template, draft=args.draft)
+        for _ in ordered_map(render, jobs, args.workers):
+            pass
+        if args.draft:
+            print("Draft previews saved, render chosen figures at full quality with: "
+                  "python render_final.py plots/<file>.plot.npz")
 
     except Exception as e:
         print(f"Runtime Error：{str(e)}")
+    close_boxplot_template()
+    prune_cache()
+    finish_profiling()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
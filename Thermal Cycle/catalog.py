@@ -0,0 +1,229 @@
+import os
+import re
+import sqlite3
+import argparse
+from parallel import ordered_map
+from result_cache import load_test_run, prune_cache
+from ingest import add_ingest_args, apply_ingest_args
+from dir_index import load_directory_index
+
+DEFAULT_DB = 'thermal_cycle_catalog.sqlite'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    path TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime_ns INTEGER,
+    type TEXT,
+    sn TEXT,
+    state_ts TEXT,
+    run_number TEXT,
+    passed INTEGER,
+    n_tests INTEGER,
+    institution TEXT,
+    parent_code TEXT,
+    parent_sn TEXT
+);
+CREATE TABLE IF NOT EXISTS failed_tests (
+    path TEXT REFERENCES runs(path) ON DELETE CASCADE,
+    position INTEGER,
+    test TEXT
+);
+CREATE TABLE IF NOT EXISTS results (
+    path TEXT REFERENCES runs(path) ON DELETE CASCADE,
+    result_index INTEGER,
+    name TEXT,
+    dimensions INTEGER
+);
+CREATE INDEX IF NOT EXISTS runs_type_sn ON runs(type, sn);
+CREATE INDEX IF NOT EXISTS runs_sn ON runs(sn);
+CREATE INDEX IF NOT EXISTS runs_state_ts ON runs(state_ts);
+CREATE INDEX IF NOT EXISTS failed_position ON failed_tests(position, path);
+CREATE INDEX IF NOT EXISTS failed_path ON failed_tests(path);
+CREATE INDEX IF NOT EXISTS results_name ON results(name, path);
+CREATE INDEX IF NOT EXISTS results_path ON results(path);
+'''
+
+def get_path(data, path):
+    current = data
+    try:
+        for key in path:
+            current = current[int(key)] if isinstance(current, list) else current[key]
+        return current
+    except (KeyError, IndexError, TypeError, ValueError):
+        return None
+
+def run_metadata(path):
+    # the catalog rows of one test run: (run fields, failed tests, results)
+    try:
+        data = load_test_run(path, values=())
+    except Exception as e:
+        print(f"Error reading {path}: {str(e)}")
+        return None
+
+    all_tests = get_path(data, ['properties', '3', 'value', 'all_tests']) or []
+    failed = get_path(data, ['properties', '3', 'value', 'failed_tests']) or []
+    passed = get_path(data, ['passed'])
+    run = {
+        'state_ts': get_path(data, ['stateTs']),
+        'run_number': get_path(data, ['runNumber']),
+        'passed': None if passed is None else int(passed is True),
+        'n_tests': len(all_tests),
+        'institution': get_path(data, ['institution', 'name']),
+        'parent_code': get_path(data, ['components', '0', 'ancestorMap', 'parent', 'component', 'type', 'code']),
+        'parent_sn': get_path(data, ['components', '0', 'ancestorMap', 'parent', 'component', 'serialNumber'])
+    }
+    # positions as boxplot.failed_indices numbers them
+    failed_tests = [(i+1, str(t)) for i, t in enumerate(all_tests) if t in failed]
+    results = [(i, result.get('name'), result.get('arrayDimensions'))
+               for i, result in enumerate(data.get('results') or []) if isinstance(result, dict)]
+    return run, failed_tests, results
+
+def connect(db_path=DEFAULT_DB):
+    conn = sqlite3.connect(db_path)
+    conn.execute('PRAGMA foreign_keys = ON')
+    conn.executescript(SCHEMA)
+    return conn
+
+def update_catalog(conn, data_root, workers=1, use_threads=False):
+    # only files that are new or whose size/mtime changed are opened; vanished files are dropped.
+    # The index only finds the files: a file rewritten in place leaves its directory's mtime alone,
+    # so size and mtime come from a fresh stat of every file
+    index = load_directory_index(data_root)
+    known = {path: (size, mtime_ns) for path, size, mtime_ns
+             in conn.execute('SELECT path, size, mtime_ns FROM runs')}
+
+    on_disk = {}
+    for type_name, entry in index.types.items():
+        for sn, serial in entry['serials'].items():
+            for name in serial['files']:
+                path = os.path.abspath(index.path(type_name, sn, name))
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                on_disk[path] = (type_name, sn, stat.st_size, stat.st_mtime_ns)
+
+    stale = [path for path, (_, _, size, mtime_ns) in on_disk.items() if known.get(path) != (size, mtime_ns)]
+    removed = [path for path in known if path not in on_disk]
+
+    with conn:
+        conn.executemany('DELETE FROM runs WHERE path = ?', [(path,) for path in removed + stale])
+        for path, metadata in zip(stale, ordered_map(run_metadata, stale, workers, use_threads)):
+            if metadata is None:
+                continue
+            run, failed_tests, results = metadata
+            type_name, sn, size, mtime_ns = on_disk[path]
+            conn.execute('INSERT INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                         (path, size, mtime_ns, type_name, sn, run['state_ts'], run['run_number'],
+                          run['passed'], run['n_tests'], run['institution'], run['parent_code'], run['parent_sn']))
+            conn.executemany('INSERT INTO failed_tests VALUES (?, ?, ?)',
+                             [(path, position, test) for position, test in failed_tests])
+            conn.executemany('INSERT INTO results VALUES (?, ?, ?, ?)',
+                             [(path, i, name, dims) for i, name, dims in results])
+    return len(stale), len(removed)
+
+def find_runs(conn, type_name=None, sn=None, passed=None, failed_tests=None, failed_after=None,
+              result_name=None, latest_only=False):
+    # paths of the runs matching every given filter, e.g. type X with test 3 or 23 failed after test 10
+    clauses = []
+    params = []
+    if type_name is not None:
+        clauses.append('r.type = ?')
+        params.append(type_name)
+    if sn is not None:
+        clauses.append('r.sn = ?')
+        params.append(sn)
+    if passed is not None:
+        clauses.append('r.passed = ?')
+        params.append(int(passed))
+    if failed_tests or failed_after is not None:
+        sub = 'SELECT 1 FROM failed_tests f WHERE f.path = r.path'
+        if failed_tests:
+            sub += f" AND f.position IN ({', '.join('?' * len(failed_tests))})"
+            params.extend(failed_tests)
+        if failed_after is not None:
+            sub += ' AND f.position > ?'
+            params.append(failed_after)
+        clauses.append(f'EXISTS ({sub})')
+    if result_name is not None:
+        clauses.append('EXISTS (SELECT 1 FROM results s WHERE s.path = r.path AND s.name = ?)')
+        params.append(result_name)
+    if latest_only:
+        clauses.append('r.state_ts = (SELECT MAX(l.state_ts) FROM runs l WHERE l.type = r.type AND l.sn = r.sn)')
+
+    query = 'SELECT r.path FROM runs r'
+    if clauses:
+        query += ' WHERE ' + ' AND '.join(clauses)
+    query += ' ORDER BY r.type, r.sn, r.state_ts'
+    return [path for (path,) in conn.execute(query, params)]
+
+def parse_positions(input_str):
+    return [int(position) for position in re.findall(r'\d+', input_str or '')]
+
+def add_filter_args(parser):
+    parser.add_argument('--catalog', default=None, metavar='DB',
+                        help="SQLite catalog (from catalog.py) used to select files before opening them")
+    parser.add_argument('--failed-tests', default=None,
+                        help="only runs where one of these test positions failed, e.g. '3,23'")
+    parser.add_argument('--failed-after', type=int, default=None,
+                        help="only runs with a failed test after this test position")
+    parser.add_argument('--passed', choices=('yes', 'no'), default=None,
+                        help="only runs that passed or failed the thermal cycle")
+    parser.add_argument('--latest', action='store_true',
+                        help="only the latest run of every SN")
+
+def filters_from_args(args):
+    return {
+        'failed_tests': parse_positions(args.failed_tests),
+        'failed_after': args.failed_after,
+        'passed': None if args.passed is None else args.passed == 'yes',
+        'latest_only': args.latest
+    }
+
+def filter_files(files, db_path, **filters):
+    # keep the files the catalog matches, in their original order
+    conn = connect(db_path)
+    try:
+        selected = set(find_runs(conn, **filters))
+    finally:
+        conn.close()
+    return [path for path in files if os.path.abspath(path) in selected]
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Index the metadata of every test run into a SQLite catalog")
+    parser.add_argument('--db', default=DEFAULT_DB,
+                        help="catalog file")
+    parser.add_argument('--type', default=None,
+                        help="list the runs of this type")
+    parser.add_argument('--sn', default=None,
+                        help="list the runs of this SerialNumber")
+    parser.add_argument('--result', default=None,
+                        help="only runs that have a result of this name")
+    add_filter_args(parser)
+    add_ingest_args(parser, workers_help="number of files read in parallel (0: all cores)", json_options=False)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    apply_ingest_args(args)
+    data_root = input("Input the data directory (Press enter for the current directory): ").strip()
+
+    conn = connect(args.db)
+    try:
+        updated, removed = update_catalog(conn, data_root, workers=args.workers, use_threads=args.threads)
+        total = conn.execute('SELECT COUNT(*) FROM runs').fetchone()[0]
+        print(f"Catalog {args.db}: {total} runs, {updated} updated, {removed} removed")
+
+        filters = filters_from_args(args)
+        if args.type or args.sn or args.result or any(filters.values()):
+            paths = find_runs(conn, type_name=args.type, sn=args.sn, result_name=args.result, **filters)
+            for path in paths:
+                print(path)
+            print(f"{len(paths)} matching runs")
+    finally:
+        conn.close()
+    prune_cache()
+
+if __name__ == "__main__":
+    main()
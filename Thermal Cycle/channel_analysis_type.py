@@ -1,14 +1,25 @@
-import json
+import argparse
+from functools import partial
 from pathlib import Path
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
-from collections import defaultdict
+from matplotlib.patches import Patch
 from datetime import datetime
+from parallel import ordered_map, read_ahead
+from result_cache import load_test_run, prune_cache
+from json_header import load_header_index, read_header, save_header_index
+from manifest import load_manifest, save_manifest, update_entries
+from dir_index import load_directory_index
+from profiling import stage, add_profile_args, start_profiling, finish_profiling
+from json_backend import compare_backends, json_files_under
+from ingest import add_ingest_args, apply_ingest_args
 
 
 WARM_TESTS = {1,4,6,8,10,12,14,16,18,20,22,25}
 COLD_TESTS = {2,3,5,7,9,11,13,15,17,19,21,23,24}
 sq = [1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16,17,18,19,20,21,22,23,24,25]
+TYPE_COLORS = ['#4D96FF', '#FF6B6B', '#2A9D8F', '#F4A261', '#9B5DE5', '#6C757D']
 
 def parse_iso_time(ts_str):
     try:
@@ -16,41 +27,66 @@ def parse_iso_time(ts_str):
     except ValueError:
         return None
 
-def find_latest_valid_json(sn_dir, required_test_count=25):
+def valid_json_candidates(sn_dir, required_test_count=25):
+    # uploads with the required number of tests, newest first; only their header is read
     valid_files = []
     total_files = 0
+    headers = load_header_index(sn_dir)
     
-    for json_file in sn_dir.glob('*.json'):
+    json_files = list(sn_dir.glob('*.json'))
+    for json_file, header, error in read_ahead(partial(read_header, index=headers), json_files):
         total_files += 1
         try:
-            with open(json_file, 'r') as f:
-                data = json.load(f)
-                
-                tests = data['properties'][3]['value']['all_tests']
-                if len(tests) != required_test_count:
-                    continue
-                
-                state_ts = data.get('stateTs')
-                if not state_ts:
-                    continue
-                    
-                file_time = parse_iso_time(state_ts)
-                if not file_time:
-                    continue
+            if error is not None:
+                raise error
+            
+            if header['n_tests'] is None:
+                raise KeyError('all_tests')
+            if header['n_tests'] != required_test_count:
+                continue
+            
+            state_ts = header['stateTs']
+            if not state_ts:
+                continue
                 
-                valid_files.append((file_time, json_file))
+            file_time = parse_iso_time(state_ts)
+            if not file_time:
+                continue
+            
+            valid_files.append((file_time, json_file))
                 
         except Exception as e:
             print(f"跳过损坏文件 {json_file}: {str(e)}")
+    save_header_index(headers)
     
     print(f"Found {total_files} files in {sn_dir.name}, {len(valid_files)} valid files")
+    valid_files.sort(key=lambda x: x[0], reverse=True)
+    return valid_files
+
+def find_latest_valid_json(sn_dir, required_test_count=25):
+    valid_files = valid_json_candidates(sn_dir, required_test_count)
     if valid_files:
-        valid_files.sort(key=lambda x: x[0])
-        latest_file = valid_files[-1][1]
-        print(f"Use latest: {latest_file.name}, time: {valid_files[-1][0]}")
+        file_time, latest_file = valid_files[0]
+        print(f"Use latest: {latest_file.name}, time: {file_time}")
         return latest_file
     return None
 
+def load_latest_valid_json(sn_dir, required_test_count=25, values=()):
+    # (file, data) of the newest upload that decodes; a file broken past its header is
+    # skipped for the next one, as when every upload was decoded in full
+    with stage('select'):
+        valid_files = valid_json_candidates(sn_dir, required_test_count)
+    for file_time, json_file in valid_files:
+        try:
+            with stage('load'):
+                data = load_test_run(json_file, values)
+        except Exception as e:
+            print(f"跳过损坏文件 {json_file}: {str(e)}")
+            continue
+        print(f"Use latest: {json_file.name}, time: {file_time}")
+        return json_file, data
+    return None
+
 def calculate_max_consecutive(channels):
     if not channels:
         return 0
@@ -65,16 +101,51 @@ def calculate_max_consecutive(channels):
             current = 1
     return max_count
 
-def process_defect_file(json_path):
-    with open(json_path, 'r') as f:
-        data = json.load(f)
+def batch_max_consecutive(stack, return_positions=False):
+    # longest run of adjacent True values along the last axis, for every leading index at once
+    stack = np.asarray(stack, dtype=bool)
+    lead_shape = stack.shape[:-1]
+    flat = stack.reshape(int(np.prod(lead_shape)), stack.shape[-1])
+    n_rows, n_channels = flat.shape
+    
+    padded = np.zeros((n_rows, n_channels + 2), dtype=np.int8)
+    padded[:, 1:-1] = flat
+    edges = np.diff(padded, axis=1)
+    rows, run_starts = np.nonzero(edges == 1)
+    _, run_ends = np.nonzero(edges == -1)          # same row-major order as the starts
+    lengths = run_ends - run_starts
     
+    max_run = np.zeros(n_rows, dtype=int)
+    position = np.full(n_rows, -1, dtype=int)
+    if lengths.size:
+        # runs are already grouped by row, so every reduction is a single linear pass
+        row_first = np.flatnonzero(np.append(True, rows[1:] != rows[:-1]))
+        row_ids = rows[row_first]
+        max_run[row_ids] = np.maximum.reduceat(lengths, row_first)
+        longest = np.flatnonzero(lengths == max_run[rows])
+        earliest = longest[np.append(True, rows[longest][1:] != rows[longest][:-1])]
+        position[rows[earliest]] = run_starts[earliest]
+    
+    max_run = max_run.reshape(lead_shape)
+    if return_positions:
+        return max_run, position.reshape(lead_shape)
+    return max_run
+
+def stack_defect_matrices(modules):
+    # (modules x tests x channels) array, zero-padded to the largest module
+    n_tests = max((matrix.shape[0] for matrix in modules), default=0)
+    n_channels = max((matrix.shape[1] for matrix in modules), default=0)
+    stack = np.zeros((len(modules), n_tests, n_channels), dtype=bool)
+    for i, matrix in enumerate(modules):
+        stack[i, :matrix.shape[0], :matrix.shape[1]] = matrix
+    return stack
+
+def defect_matrix(data):
+    # (tests x channels) boolean matrix of the bad channels listed in 'defects'
     all_tests = data['properties'][3]['value']['all_tests']
     test_name_to_index = {test: idx for idx, test in enumerate(all_tests)}
     
-    records = []
-    seen = set()
-    
+    ranges = []
     for defect in data.get('defects', []):
         props = defect.get('properties', {})
         run_num = props.get('runNumber')
@@ -83,157 +154,220 @@ def process_defect_file(json_path):
         if not run_num or not test_type:
             continue
             
-        full_test_name = f"{run_num}_{test_type}"
-        test_index = test_name_to_index.get(full_test_name)
-        
+        test_index = test_name_to_index.get(f"{run_num}_{test_type}")
         if test_index is None:
             continue
         
-        channels = []
         if 'channel_from' in props and 'channel_to' in props:
-            channels = range(props['channel_from'], props['channel_to']+1)
+            ranges.append((test_index, props['channel_from'], props['channel_to'] + 1))
         elif 'channel' in props:
-            channels = [props['channel']]
-        else:
+            ranges.append((test_index, props['channel'], props['channel'] + 1))
+    
+    n_channels = max((stop for _, _, stop in ranges), default=0)
+    matrix = np.zeros((len(all_tests), n_channels), dtype=bool)
+    for test_index, start, stop in ranges:
+        matrix[test_index, max(start, 0):stop] = True
+    return matrix, list(all_tests)
+
+def defect_matrix_from_frame(df):
+    # per-channel records of process_defect_file back to the matrix form
+    if df.empty:
+        return np.zeros((0, 0), dtype=bool), []
+    n_tests = int(df['test_index'].max()) + 1
+    matrix = np.zeros((n_tests, int(df['channel'].max()) + 1), dtype=bool)
+    matrix[df['test_index'].to_numpy(), df['channel'].to_numpy()] = True
+    test_names = [None] * n_tests
+    for test_index, test_name in zip(df['test_index'], df['test_name']):
+        test_names[test_index] = test_name
+    return matrix, test_names
+
+def process_defect_matrix(json_path):
+    with stage('load'):
+        data = load_test_run(json_path, values=())
+    with stage('defect_matrix'):
+        return defect_matrix(data)
+
+def process_defect_file(json_path):
+    return defect_frame(*process_defect_matrix(json_path))
+
+def defect_frame(matrix, all_tests):
+    test_index, channel = np.nonzero(matrix)
+    return pd.DataFrame({
+        'test_index': test_index,
+        'test_name': [all_tests[i] for i in test_index],
+        'channel': channel
+    })
+
+def aggregate_module_stats(all_data):
+    # per-module x per-test totals and longest runs, computed once for every plot
+    sns = list(all_data)
+    modules = [module if not isinstance(module, pd.DataFrame) else defect_matrix_from_frame(module)
+               for module in all_data.values()]
+    stack = stack_defect_matrices([matrix for matrix, _ in modules])
+    return {
+        'SN': sns,
+        'TotalBad': stack.sum(axis=2),
+        'MaxConsecutive': batch_max_consecutive(stack)
+    }
+
+def box_stats(values, present, whis=1.5):
+    # the statistics plt.boxplot would compute for each column, restricted to the present rows
+    data = np.where(present, values, np.nan).astype(float)
+    q1, med, q3 = np.nanpercentile(data, [25, 50, 75], axis=0)
+    iqr = q3 - q1
+    whislo = np.nanmin(np.where(data >= q1 - whis * iqr, data, np.nan), axis=0)
+    whislo = np.where(np.isnan(whislo) | (whislo > q1), q1, whislo)
+    whishi = np.nanmax(np.where(data <= q3 + whis * iqr, data, np.nan), axis=0)
+    whishi = np.where(np.isnan(whishi) | (whishi < q3), q3, whishi)
+    flier_mask = present & ((data < whislo) | (data > whishi))
+    
+    return [{
+        'med': med[col], 'q1': q1[col], 'q3': q3[col],
+        'whislo': whislo[col], 'whishi': whishi[col],
+        'fliers': data[flier_mask[:, col], col]
+    } for col in range(data.shape[1])]
+
+def histogram_counts(values, present, n_bins=50):
+    # integer counts per column, binned as hist(bins=n_bins, range=(0, n_bins)) would
+    n_cols = values.shape[1]
+    in_range = present & (values >= 0) & (values <= n_bins)
+    binned = np.where(in_range, values, n_bins + 1) + np.arange(n_cols) * (n_bins + 2)
+    counts = np.bincount(binned.ravel(), minlength=n_cols * (n_bins + 2)).reshape(n_cols, n_bins + 2)
+    counts[:, n_bins - 1] += counts[:, n_bins]         # last bin is closed on the right
+    return counts[:, :n_bins]
+
+def plot_test_boxes(values, present, positions, title, ylabel, xlabel, showfliers, title_size=None, label_size=None):
+    fig, ax = plt.subplots(figsize=(12, 9))
+    colors = ['#FF6B6B' if test_index in WARM_TESTS else '#4D96FF' for test_index in positions]
+    box = ax.bxp(
+        box_stats(values[:, positions], present[:, positions]),
+        positions=positions,
+        patch_artist=True,
+        widths=0.6,
+        showfliers=showfliers
+    )
+    for patch, color in zip(box['boxes'], colors):
+        patch.set_facecolor(color)
+        patch.set_edgecolor('black')
+    title_kw = {'fontsize': title_size} if title_size else {}
+    label_kw = {'fontsize': label_size} if label_size else {}
+    ax.set_title(title, **title_kw)
+    ax.set_ylabel(ylabel, **label_kw)
+    ax.set_xlabel(xlabel, **label_kw)
+    ax.set_xticks(positions, [f"T{i:02d}" for i in positions])
+    ax.grid(True, axis='y', linestyle='--', alpha=0.7)
+    return fig
+
+def plot_grouped_test_boxes(groups, title, ylabel, xlabel, showfliers=False, first_test=0):
+    # side-by-side boxes per test, one colour per group; groups: {label: (values, present)}, modules x tests
+    n_groups = len(groups)
+    n_tests = max(values.shape[1] for values, _ in groups.values())
+    width = 0.8 / n_groups
+    fig, ax = plt.subplots(figsize=(max(12, 0.35 * n_tests * n_groups), 9))
+    
+    handles = []
+    for i, (label, (values, present)) in enumerate(groups.items()):
+        tests = [int(test_index) for test_index in np.flatnonzero(present.any(axis=0))]
+        if not tests:
             continue
-        
-        for ch in channels:
-            unique_key = (test_index, ch)
-            if unique_key not in seen:
-                seen.add(unique_key)
-                records.append({
-                    'test_index': test_index,
-                    'test_name': full_test_name,
-                    'channel': ch
-                })
+        color = TYPE_COLORS[i % len(TYPE_COLORS)]
+        offset = (i - (n_groups - 1) / 2) * width
+        box = ax.bxp(
+            box_stats(values[:, tests], present[:, tests]),
+            positions=[test_index + first_test + offset for test_index in tests],
+            patch_artist=True,
+            widths=0.9 * width,
+            showfliers=showfliers,
+            manage_ticks=False
+        )
+        for patch in box['boxes']:
+            patch.set_facecolor(color)
+            patch.set_edgecolor('black')
+        handles.append(Patch(facecolor=color, edgecolor='black', label=f"{label} ({len(values)} modules)"))
     
-    return pd.DataFrame(records)
+    ticks = range(first_test, n_tests + first_test)
+    ax.set_xticks(ticks, [f"T{i:02d}" for i in ticks])
+    ax.set_xlim(first_test - 0.5, n_tests + first_test - 0.5)
+    ax.legend(handles=handles, loc='upper right')
+    ax.set_title(title, fontsize=14)
+    ax.set_ylabel(ylabel, fontsize=12)
+    ax.set_xlabel(xlabel, fontsize=12)
+    ax.grid(True, axis='y', linestyle='--', alpha=0.7)
+    return fig
+
+def plot_type_comparison(type_stats):
+    groups_total = {}
+    groups_consec = {}
+    for type_name, stats in type_stats.items():
+        present = stats['TotalBad'] > 0
+        groups_total[type_name] = (stats['TotalBad'], present)
+        groups_consec[type_name] = (stats['MaxConsecutive'], present)
+    names = ', '.join(type_stats)
+    total_box = plot_grouped_test_boxes(groups_total, f'Total Bad Channels by Test - {names}',
+                                        'Total Bad Channels', 'Test Sequence Number')
+    consecutive_box = plot_grouped_test_boxes(groups_consec, f'Max Consecutive Bad Channels by Test - {names}',
+                                              'Max Consecutive Bad Channels', 'Test Sequence Number',
+                                              showfliers=True)
+    return total_box, consecutive_box
 
 def create_module_level_plots(type_name, all_data):
     if not all_data:
         print(f"No valid data found for type {type_name}")
         return None, None, None
     
-    total_stats = []
-    consecutive_stats = []
-    distribution_data = defaultdict(lambda: defaultdict(int))
-    consecutive_dist_data = defaultdict(lambda: defaultdict(int))
-    
-    for sn, df in all_data.items():
-        grouped = df.groupby('test_index')
-        
-        test_stats = grouped.agg(
-            total_bad=('channel', 'count'),
-            test_name=('test_name', 'first'),
-            channels=('channel', list)
-        ).reset_index()
-        test_stats['max_consecutive'] = test_stats['channels'].apply(
-            lambda x: calculate_max_consecutive(x)
-        )
-        
-        for _, row in test_stats.iterrows():
-            total_stats.append({
-                'test_index': row['test_index'],
-                'test_name': row['test_name'],
-                'SN': sn,
-                'TotalBad': row['total_bad']
-            })
-            
-            consecutive_stats.append({
-                'test_index': row['test_index'],
-                'test_name': row['test_name'],
-                'SN': sn,
-                'MaxConsecutive': row['max_consecutive']
-            })
-            
-            distribution_data[row['test_index']][row['total_bad']] += 1
-            consecutive_dist_data[row['test_index']][row['max_consecutive']] += 1
-    
-    total_df = pd.DataFrame(total_stats).sort_values('test_index')
-    consecutive_df = pd.DataFrame(consecutive_stats).sort_values('test_index')
-    colors = ['#FF6B6B' if num in WARM_TESTS else '#4D96FF' for num in sq]
+    with stage('aggregate'):
+        stats = aggregate_module_stats(all_data)
+    with stage('plot'):
+        return plot_module_stats(type_name, stats)
+
+def plot_module_stats(type_name, stats):
+    total_bad = stats['TotalBad']
+    max_consecutive = stats['MaxConsecutive']
+    present = total_bad > 0
+    positions = [int(test_index) for test_index in np.flatnonzero(present.any(axis=0))]
     
     # bad channel box
-    plt.figure(figsize=(12, 9))
-    plot_data = []
-    positions = []
-    colors = []
-    for test_index in sorted(total_df['test_index'].unique()):
-        subset = total_df[total_df['test_index'] == test_index]['TotalBad']
-        plot_data.append(subset)
-        positions.append(test_index)
-        colors.append('#FF6B6B' if test_index in WARM_TESTS else '#4D96FF')
-    box = plt.boxplot(
-        plot_data,
-        positions=positions,
-        whis=1.5,
-        patch_artist=True,
-        widths=0.6,
-        showfliers=False
+    total_box = plot_test_boxes(
+        total_bad, present, positions,
+        f'Total Bad Channels by Test - {type_name}',
+        'Total Bad Channels', 'Test Sequence Number',
+        showfliers=False, title_size=14, label_size=12
     )
-    for patch, color in zip(box['boxes'], colors):
-        patch.set_facecolor(color)
-        patch.set_edgecolor('black')
-    plt.title(f'Total Bad Channels by Test - {type_name}', fontsize=14)
-    plt.ylabel('Total Bad Channels', fontsize=12)
-    plt.xlabel('Test Sequence Number', fontsize=12)
-    plt.xticks(positions, [f"T{i:02d}" for i in positions])
-    plt.grid(True, axis='y', linestyle='--', alpha=0.7)
-    total_box = plt.gcf()
     
-     # consecutive bad channel box
-    plt.figure(figsize=(12, 9))
-    plot_data = []
-    positions = []
-    colors = []
-    for test_index in sorted(consecutive_df['test_index'].unique()):
-        subset = consecutive_df[consecutive_df['test_index'] == test_index]['MaxConsecutive']
-        plot_data.append(subset)
-        positions.append(test_index)
-        colors.append('#FF6B6B' if test_index in WARM_TESTS else '#4D96FF')
-    box = plt.boxplot(
-        plot_data,
-        positions=positions,
-        patch_artist=True,
-        widths=0.6,
+    # consecutive bad channel box
+    consecutive_box = plot_test_boxes(
+        max_consecutive, present, positions,
+        f'Max Consecutive Bad Channels by Test - {type_name}',
+        'Max Consecutive Bad Channels', 'Test Sequence Number',
         showfliers=True
     )
-    for patch, color in zip(box['boxes'], colors):
-        patch.set_facecolor(color)
-        patch.set_edgecolor('black')
-    plt.title(f'Max Consecutive Bad Channels by Test - {type_name}')
-    plt.ylabel('Max Consecutive Bad Channels')
-    plt.xlabel('Test Sequence Number')
-    plt.xticks(positions, [f"T{i:02d}" for i in positions])
-    plt.grid(True, axis='y', linestyle='--', alpha=0.7)
-    consecutive_box = plt.gcf()
     
     # distribution
-    fig, axes = plt.subplots(len(distribution_data), 2, 
-                       figsize=(20, 3*len(distribution_data)))
-    if len(distribution_data) == 1:
+    total_counts = histogram_counts(total_bad[:, positions], present[:, positions])
+    consec_counts = histogram_counts(max_consecutive[:, positions], present[:, positions])
+    total_failed = ((total_bad > 12) & present).sum(axis=0)
+    consec_failed = ((max_consecutive > 8) & present).sum(axis=0)
+    bin_values = np.arange(50)
+    
+    fig, axes = plt.subplots(len(positions), 2, 
+                       figsize=(20, 3*len(positions)))
+    if len(positions) == 1:
         axes = [axes]
 
-    for i, (test_index, counts) in enumerate(sorted(distribution_data.items())):
-        test_name = total_df[total_df['test_index'] == test_index]['test_name'].iloc[0]
-    
-        total_bad_data = []
-        for value, freq in counts.items():
-            total_bad_data.extend([value] * freq)
-    
+    for i, test_index in enumerate(positions):
         axes[i][0].hist(
-            total_bad_data,
+            bin_values,
             bins=50,
             range=(0, 50),
+            weights=total_counts[i],
             color='#4D96FF',
             edgecolor='white',
             alpha=0.8
         )
         axes[i][0].axvline(13, color='red', linestyle='--', linewidth=1.5)
-        over_threshold = sum(1 for x in total_bad_data if x > 12)
         axes[i][0].text(
             0.95, 0.95, 
-            f'Failed hybrids in total: {over_threshold}',
+            f'Failed hybrids in total: {total_failed[test_index]}',
             transform=axes[i][0].transAxes,
             ha='right', va='top',
             fontsize=12,
@@ -245,24 +379,19 @@ def create_module_level_plots(type_name, all_data):
         axes[i][0].set_ylabel('Number of modules')
         axes[i][0].grid(True, linestyle='--', alpha=0.6)
     
-        consec_bad_data = []
-        consec_counts = consecutive_dist_data[test_index]
-        for value, freq in consec_counts.items():
-            consec_bad_data.extend([value] * freq)
-    
         axes[i][1].hist(
-            consec_bad_data,
+            bin_values,
             bins=50,
             range=(0, 50),
+            weights=consec_counts[i],
             color='#FF6B6B',
             edgecolor='white',
             alpha=0.8
         )
         axes[i][1].axvline(9, color='blue', linestyle='--', linewidth=1.5)
-        over_threshold = sum(1 for x in consec_bad_data if x > 8)
         axes[i][1].text(
             0.95, 0.95,
-            f'Failed hybrids in total: {over_threshold}',
+            f'Failed hybrids in total: {consec_failed[test_index]}',
             transform=axes[i][1].transAxes,
             ha='right', va='top',
             fontsize=12,
@@ -280,62 +409,213 @@ def create_module_level_plots(type_name, all_data):
     
     return total_box, consecutive_box, dist_fig
 
-def process_type_analysis(base_path, type_name, required_test_count=25):
+def load_sn_defects(sn_dir, required_test_count=25):
+    latest = load_latest_valid_json(sn_dir, required_test_count)
+    if not latest:
+        return None
+        
+    with stage('defect_matrix'):
+        matrix, all_tests = defect_matrix(latest[1])
+    if not matrix.any():
+        return None
+    return matrix, all_tests
+
+def process_type_analysis(base_path, type_name, required_test_count=25, workers=1, use_threads=False):
     type_dir = Path(base_path) / type_name
     if not type_dir.exists():
         print(f"Type directory not found: {type_dir}")
         return None
     
     all_data = {}
+    with stage('discover'):
+        sn_dirs = [Path(sn_dir) for sn_dir in load_directory_index(str(base_path), [type_name]).sn_dirs(type_name)]
+    load = partial(load_sn_defects, required_test_count=required_test_count)
     
-    for sn_dir in type_dir.iterdir():
-        if not sn_dir.is_dir():
+    for sn_dir, module in zip(sn_dirs, ordered_map(load, sn_dirs, workers, use_threads)):
+        if module is None:
             continue
             
-        json_file = find_latest_valid_json(sn_dir, required_test_count)
-        if not json_file:
-            continue
-            
-        df = process_defect_file(json_file)
-        if df.empty:
-            continue
-            
-        all_data[sn_dir.name] = df
+        all_data[sn_dir.name] = module
     
     return all_data
 
-def main():
+def process_types_analysis(base_path, type_names, required_test_count=25, workers=1, use_threads=False):
+    # the SNs of every type share one pool and one directory walk: {type: {sn: (matrix, all_tests)}}
+    all_types = {}
+    jobs = []
+    with stage('discover'):
+        index = load_directory_index(str(base_path), type_names)
+        for type_name in type_names:
+            if not (Path(base_path) / type_name).exists():
+                print(f"Type directory not found: {Path(base_path) / type_name}")
+                continue
+            all_types[type_name] = {}
+            jobs.extend((type_name, Path(sn_dir)) for sn_dir in index.sn_dirs(type_name))
+    load = partial(load_sn_defects, required_test_count=required_test_count)
+    
+    modules = ordered_map(load, [sn_dir for _, sn_dir in jobs], workers, use_threads)
+    for (type_name, sn_dir), module in zip(jobs, modules):
+        if module is not None:
+            all_types[type_name][sn_dir.name] = module
+    return all_types
+
+def compare_types(base_path, type_names, output_dir, workers=1, use_threads=False):
+    with stage('ingest'):
+        all_types = process_types_analysis(base_path, type_names, workers=workers, use_threads=use_threads)
+    for type_name, all_data in all_types.items():
+        print(f"{type_name}: {len(all_data)} modules")
+    with stage('aggregate'):
+        type_stats = {type_name: aggregate_module_stats(all_data)
+                      for type_name, all_data in all_types.items() if all_data}
+    if not type_stats:
+        print("No valid data found for analysis")
+        return
+    
+    with stage('plot'):
+        total_box, consecutive_box = plot_type_comparison(type_stats)
+    output_dir.mkdir(exist_ok=True)
+    stem = '_vs_'.join(type_stats)
+    for fig, suffix, label in [(total_box, 'total_box', 'Total bad channels'),
+                               (consecutive_box, 'consecutive_box', 'Max consecutive bad channels')]:
+        path = output_dir / f"{stem}_{suffix}.png"
+        with stage('savefig'):
+            fig.savefig(path, bbox_inches='tight')
+        plt.close(fig)
+        print(f"{label} comparison saved to: {path}")
+
+def module_summary(sn_dir, required_test_count=25):
+    # what the manifest keeps per SN: the upload used and its per-test aggregates
+    latest = load_latest_valid_json(sn_dir, required_test_count)
+    if not latest:
+        return {'file': None}
+
+    json_file, data = latest
+    with stage('defect_matrix'):
+        matrix, _ = defect_matrix(data)
+    summary = {'file': str(json_file), 'stateTs': data.get('stateTs')}
+    if matrix.any():
+        with stage('aggregate'):
+            summary['TotalBad'] = matrix.sum(axis=1).tolist()
+            summary['MaxConsecutive'] = batch_max_consecutive(matrix).tolist()
+    return summary
+
+def stats_from_summaries(entries):
+    modules = {sn: entry for sn, entry in entries.items() if entry.get('TotalBad') is not None}
+    if not modules:
+        return None
+
+    n_tests = max(len(entry['TotalBad']) for entry in modules.values())
+    total_bad = np.zeros((len(modules), n_tests), dtype=int)
+    max_consecutive = np.zeros((len(modules), n_tests), dtype=int)
+    for row, entry in enumerate(modules.values()):
+        total_bad[row, :len(entry['TotalBad'])] = entry['TotalBad']
+        max_consecutive[row, :len(entry['MaxConsecutive'])] = entry['MaxConsecutive']
+    return {'SN': list(modules), 'TotalBad': total_bad, 'MaxConsecutive': max_consecutive}
+
+def process_type_incremental(base_path, type_name, manifest_path, required_test_count=25, workers=1, use_threads=False):
+    # only SN directories with new, replaced or removed uploads since the last run are reparsed
+    type_dir = Path(base_path) / type_name
+    if not type_dir.exists():
+        print(f"Type directory not found: {type_dir}")
+        return None, []
+
+    key = {'type_dir': str(type_dir.resolve()), 'required_test_count': required_test_count}
+    with stage('discover'):
+        sn_dirs = [Path(sn_dir) for sn_dir in load_directory_index(str(base_path), [type_name]).sn_dirs(type_name)]
+    compute = partial(module_summary, required_test_count=required_test_count)
+    entries, changed = update_entries(load_manifest(manifest_path, key), sn_dirs, compute,
+                                      workers, use_threads)
+    save_manifest(manifest_path, key, entries)
+    print(f"{len(changed)} of {len(entries)} SN directories updated since the last run")
+    return stats_from_summaries(entries), changed
+
+def save_module_plots(figures, output_dir, target_type):
+    total_box, consecutive_box, dist_fig = figures
+    output_dir.mkdir(exist_ok=True)
+    
+    if total_box:
+        total_path = output_dir / f"{target_type}_total_box.png"
+        with stage('savefig'):
+            total_box.savefig(total_path, bbox_inches='tight')
+        plt.close(total_box)
+        print(f"Total bad channels boxplot saved to: {total_path}")
+    
+    if consecutive_box:
+        consec_path = output_dir / f"{target_type}_consecutive_box.png"
+        with stage('savefig'):
+            consecutive_box.savefig(consec_path, bbox_inches='tight')
+        plt.close(consecutive_box)
+        print(f"Max consecutive bad channels boxplot saved to: {consec_path}")
+    
+    if dist_fig:
+        dist_path = output_dir / f"{target_type}_distribution.png"
+        with stage('savefig'):
+            dist_fig.savefig(dist_path, bbox_inches='tight')
+        plt.close(dist_fig)
+        print(f"Distribution plots saved to: {dist_path}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Module-level bad channel analysis of one type")
+    add_ingest_args(parser)
+    parser.add_argument('--incremental', action='store_true',
+                        help="keep per-SN results in a manifest and only reparse SNs with new uploads")
+    add_profile_args(parser)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    apply_ingest_args(args)
+    start_profiling(args)
     base_path = input("Directory:").strip()
-    target_type = input("Type:").strip()
+    target_type = input("Type (several separated by commas to compare):").strip()
+    output_dir = Path("module_analysis")
+    
+    type_names = [type_name.strip() for type_name in target_type.split(',') if type_name.strip()]
+    if len(type_names) > 1:
+        print(f"\nComparing module-level analysis for: {', '.join(type_names)}")
+        if args.incremental:
+            print("Warning: --incremental is not supported when comparing types, every SN is reparsed")
+        if args.compare_json:
+            for type_name in type_names:
+                compare_backends(json_files_under(Path(base_path) / type_name))
+        compare_types(base_path, type_names, output_dir, workers=args.workers, use_threads=args.threads)
+        prune_cache()
+        finish_profiling()
+        return
     
     print(f"\nProcessing module-level analysis for: {target_type}")
-    all_data = process_type_analysis(base_path, target_type)
+    if args.compare_json:
+        compare_backends(json_files_under(Path(base_path) / target_type))
+    if args.incremental:
+        manifest_path = output_dir / f"{target_type}_manifest.json"
+        with stage('ingest'):
+            stats, changed = process_type_incremental(base_path, target_type, manifest_path,
+                                                      workers=args.workers, use_threads=args.threads)
+        outputs = [output_dir / f"{target_type}_{suffix}.png"
+                   for suffix in ('total_box', 'consecutive_box', 'distribution')]
+        if stats is None:
+            print("No valid data found for analysis")
+        elif not changed and all(path.exists() for path in outputs):
+            print("No new uploads since the last run, plots are up to date")
+        else:
+            with stage('plot'):
+                figures = plot_module_stats(target_type, stats)
+            save_module_plots(figures, output_dir, target_type)
+        prune_cache()
+        finish_profiling()
+        return
+
+    with stage('ingest'):
+        all_data = process_type_analysis(base_path, target_type,
+                                         workers=args.workers, use_threads=args.threads)
     #print(all_data)
     print(len(all_data))
     if all_data:
-        total_box, consecutive_box, dist_fig = create_module_level_plots(target_type, all_data)
-        output_dir = Path("module_analysis")
-        output_dir.mkdir(exist_ok=True)
-        
-        if total_box:
-            total_path = output_dir / f"{target_type}_total_box.png"
-            total_box.savefig(total_path, bbox_inches='tight')
-            plt.close(total_box)
-            print(f"Total bad channels boxplot saved to: {total_path}")
-        
-        if consecutive_box:
-            consec_path = output_dir / f"{target_type}_consecutive_box.png"
-            consecutive_box.savefig(consec_path, bbox_inches='tight')
-            plt.close(consecutive_box)
-            print(f"Max consecutive bad channels boxplot saved to: {consec_path}")
-        
-        if dist_fig:
-            dist_path = output_dir / f"{target_type}_distribution.png"
-            dist_fig.savefig(dist_path, bbox_inches='tight')
-            plt.close(dist_fig)
-            print(f"Distribution plots saved to: {dist_path}")
+        save_module_plots(create_module_level_plots(target_type, all_data), output_dir, target_type)
     else:
         print("No valid data found for analysis")
+    prune_cache()
+    finish_profiling()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
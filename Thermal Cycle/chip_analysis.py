@@ -1,9 +1,23 @@
 import os
-import json
+import argparse
+import re
 import numpy as np
 import matplotlib.pyplot as plt
 from datetime import datetime
 from collections import defaultdict
+from functools import partial
+from itertools import groupby
+from operator import itemgetter
+from parallel import ordered_map, read_ahead
+from result_cache import load_test_run, prune_cache
+from json_header import load_header_index, read_header, save_header_index
+from manifest import load_manifest, save_manifest, update_entries
+from dir_index import load_directory_index, split_type_dir
+from profiling import stage, add_profile_args, start_profiling, finish_profiling
+from channel_analysis_type import plot_grouped_test_boxes
+from json_backend import compare_backends, json_files_under
+from ingest import add_ingest_args, apply_ingest_args
+from draft import save_options, figure_path, record_inputs, add_draft_args
 
 TIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
 
@@ -13,82 +27,288 @@ def parse_timestamp(ts_str):
     except (ValueError, TypeError):
         return datetime.min
 
-def get_latest_json_per_serial(serial_dir):
-    file_times = []
-    for file in os.listdir(serial_dir):
-        if not file.endswith('.json'):
-            continue
-        
-        file_path = os.path.join(serial_dir, file)
+def get_latest_json_per_serial(serial_dir, values='all'):
+    with stage('select'):
+        file_times = []
+        headers = load_header_index(serial_dir)
+        json_files = [os.path.join(serial_dir, file) for file in os.listdir(serial_dir) if file.endswith('.json')]
+        for file_path, header, error in read_ahead(partial(read_header, index=headers), json_files):
+            try:
+                if error is not None:
+                    raise error
+                ts = parse_timestamp(header['stateTs'] or '')
+                file_times.append((ts, file_path))
+            except Exception as e:
+                print(f"Error reading {file_path}: {str(e)}")
+                continue
+        save_header_index(headers)
+    
+    # only the winning upload is decoded in full
+    while file_times:
+        latest_file = max(file_times, key=lambda x: x[0])
         try:
-            with open(file_path, 'r') as f:
-                data = json.load(f)
-                ts = parse_timestamp(data.get('stateTs', ''))
-                file_times.append((ts, file_path, data))
+            with stage('load'):
+                data = load_test_run(latest_file[1], values)
         except Exception as e:
-            print(f"Error reading {file_path}: {str(e)}")
+            print(f"Error reading {latest_file[1]}: {str(e)}")
+            file_times.remove(latest_file)
             continue
-    
-    if file_times:
-        latest_file = max(file_times, key=lambda x: x[0])
         print(f"Found {len(file_times)} files in '{os.path.basename(serial_dir)}', use latest: '{latest_file[0]}'")
-        return latest_file
-    else:
-        return None
+        return (latest_file[0], latest_file[1], data)
+    return None
 
-def collect_chip_data(type_dir, result_num):
-    chip_data = defaultdict(lambda: defaultdict(list))
-    result_num_int = int(result_num)
-    valid_files = 0
-    result_name = None  
-    
-    for sn in os.listdir(type_dir):
-        sn_path = os.path.join(type_dir, sn)
-        if not os.path.isdir(sn_path):
-            continue
+def extract_chip_values(data, file_path, result_num_int):
+    try:
+        result_entry = data['results'][result_num_int]
+        array_dims = result_entry['arrayDimensions']
+        if array_dims == 3:
+            print(f"{file_path} arrayDimensions = 3, skip")
+            return None
+        elif array_dims != 2:
+            print(f"File {file_path} arrayDimensions is {array_dims}, skip")
+            return None
         
-        latest_json = get_latest_json_per_serial(sn_path)
-        if not latest_json:
-            continue
-            
-        _, file_path, data = latest_json
+        values = result_entry['value']
+        if len(values) != 25:
+            print(f"{file_path} has {len(values)} tests, skip")
+            return None
         
-        try:
-            result_entry = data['results'][result_num_int]
-            array_dims = result_entry['arrayDimensions']
-            if array_dims == 3:
-                print(f"{file_path} arrayDimensions = 3, skip")
-                continue
-            elif array_dims != 2:
-                print(f"File {file_path} arrayDimensions is {array_dims}, skip")
-                continue
-            
-            values = result_entry['value']
-            if len(values) != 25:
-                print(f"{file_path} has {len(values)} tests, skip")
+        values = [[float(value) for value in test_values] for test_values in values]
+        return result_entry['name'], values
+    except (KeyError, IndexError, ValueError, TypeError) as e:
+        print(f"File {file_path} wrong: {str(e)}, skip")
+        return None
+
+def load_chip_values(sn_path, result_nums):
+    # every requested result of the latest upload, from a single decode
+    latest_json = get_latest_json_per_serial(sn_path, result_nums)
+    if not latest_json:
+        return None
+        
+    _, file_path, data = latest_json
+    
+    if result_nums == 'all':
+        results = data.get('results') or []
+        result_nums = [idx for idx, result_entry in enumerate(results)
+                       if isinstance(result_entry, dict) and result_entry.get('arrayDimensions') == 2]
+    
+    loaded = {}
+    for result_num_int in result_nums:
+        with stage('extract'):
+            extracted = extract_chip_values(data, file_path, result_num_int)
+        if extracted is not None:
+            loaded[result_num_int] = extracted
+    return loaded
+
+class RunningChipStats:
+    # Welford mean/variance per (test, chip), memory independent of the number of modules
+    def __init__(self, n_tests=25):
+        self.n_tests = n_tests
+        self.count = np.zeros((n_tests, 0))
+        self.mean = np.zeros((n_tests, 0))
+        self.m2 = np.zeros((n_tests, 0))
+
+    def __len__(self):
+        return int(np.count_nonzero(self.count.sum(axis=0)))
+
+    def grow(self, n_chips):
+        pad = n_chips - self.count.shape[1]
+        if pad > 0:
+            self.count = np.pad(self.count, ((0, 0), (0, pad)))
+            self.mean = np.pad(self.mean, ((0, 0), (0, pad)))
+            self.m2 = np.pad(self.m2, ((0, 0), (0, pad)))
+
+    def add(self, values):
+        n_chips = max((len(test_values) for test_values in values), default=0)
+        self.grow(n_chips)
+        x = np.full(self.count.shape, np.nan)
+        for test_idx, test_values in enumerate(values):
+            x[test_idx, :len(test_values)] = test_values
+        mask = ~np.isnan(x)
+
+        self.count += mask
+        delta = np.where(mask, x - self.mean, 0.0)
+        self.mean += np.divide(delta, self.count, out=np.zeros_like(delta), where=mask)
+        self.m2 += np.where(mask, delta * (x - self.mean), 0.0)
+
+    def series(self):
+        tests_with_data = self.count.sum(axis=1) > 0
+        test_numbers = [int(t) + 1 for t in np.flatnonzero(tests_with_data)]
+        series = []
+        for chip_idx in range(self.count.shape[1]):
+            n = self.count[:, chip_idx]
+            filled = n > 0
+            if not filled.any():
                 continue
-            
-            if result_name is None:
-                result_name = result_entry['name']
-            
-            valid_files += 1
-            for test_num, test_values in enumerate(values, 1):
-                for chip_idx, value in enumerate(test_values):
-                    chip_data[chip_idx][test_num].append(float(value))
-        except (KeyError, IndexError, ValueError, TypeError) as e:
-            print(f"File {file_path} wrong: {str(e)}, skip")
+            std = np.sqrt(self.m2[filled, chip_idx] / n[filled])
+            series.append((chip_idx,
+                           (np.flatnonzero(filled) + 1).tolist(),
+                           self.mean[filled, chip_idx].tolist(),
+                           (std / np.sqrt(n[filled])).tolist()))
+        return test_numbers, series
+
+def add_chip_values(chip_data, values):
+    if isinstance(chip_data, RunningChipStats):
+        chip_data.add(values)
+        return
+    for test_num, test_values in enumerate(values, 1):
+        for chip_idx, value in enumerate(test_values):
+            chip_data[chip_idx][test_num].append(value)
+
+def merge_chip_values(loaded_modules, result_nums, streaming=False):
+    # accumulate per-SN {result_num: (name, values)} dicts: {result_num: (chip_data, result_name)}
+    chip_data = {}
+    result_names = {}
+    valid_files = defaultdict(int)
+    
+    for loaded in loaded_modules:
+        if not loaded:
             continue
+            
+        for result_num, (name, values) in loaded.items():
+            if result_num not in chip_data:
+                chip_data[result_num] = RunningChipStats() if streaming else defaultdict(lambda: defaultdict(list))
+                result_names[result_num] = name
+            valid_files[result_num] += 1
+            with stage('accumulate'):
+                add_chip_values(chip_data[result_num], values)
     
-    print(f"\nValid merged data: {valid_files}")
-    return (chip_data, result_name) if chip_data else (None, None)
+    if result_nums != 'all' and len(result_nums) == 1:
+        print(f"\nValid merged data: {valid_files[result_nums[0]]}")
+    else:
+        print()
+        for result_num in sorted(chip_data):
+            print(f"Valid merged data for {result_names[result_num]}: {valid_files[result_num]}")
+    return {result_num: (chip_data[result_num], result_names[result_num])
+            for result_num in sorted(chip_data) if len(chip_data[result_num])}
 
-def plot_chip_means(chip_data, output_path, type, result_name):
-    output_dir = os.path.dirname(output_path)
-    os.makedirs(output_dir, exist_ok=True)
-    plt.figure(figsize=(12, 9))
+def list_sn_paths(type_dir):
+    root, type_name = split_type_dir(type_dir)
+    return load_directory_index(root, [type_name]).sn_dirs(type_name)
+
+def collect_multi_chip_data(type_dir, result_nums='all', workers=1, use_threads=False, streaming=False):
+    # one pass over the type directory for several results: {result_num: (chip_data, result_name)}
+    if result_nums != 'all':
+        result_nums = [int(result_num) for result_num in result_nums]
+    load = partial(load_chip_values, result_nums=result_nums)
+    loaded_modules = ordered_map(load, list_sn_paths(type_dir), workers, use_threads)
+    return merge_chip_values(loaded_modules, result_nums, streaming)
+
+def collect_types_chip_data(type_dirs, result_nums='all', workers=1, use_threads=False, streaming=False):
+    # the SNs of every type share one pool, each upload is decoded once:
+    # ({type_dir: {result_num: (chip_data, name)}}, {type_dir: {result_num: (name, module x test means)}})
+    if result_nums != 'all':
+        result_nums = [int(result_num) for result_num in result_nums]
+    jobs = [(type_dir, sn_path) for type_dir in type_dirs for sn_path in list_sn_paths(type_dir)]
+    load = partial(load_chip_values, result_nums=result_nums)
+    loaded_modules = ordered_map(load, [sn_path for _, sn_path in jobs], workers, use_threads)
     
-    test_numbers = sorted({tn for chip in chip_data.values() for tn in chip.keys()})
+    # jobs are grouped by type, so every type is merged while the modules stream in
+    collected = {type_dir: {} for type_dir in type_dirs}
+    module_means = {type_dir: {} for type_dir in type_dirs}
+    for type_dir, group in groupby(zip((type_dir for type_dir, _ in jobs), loaded_modules), key=itemgetter(0)):
+        print(f"\n{os.path.basename(os.path.normpath(type_dir))}:", end='')
+        means = {}
+        collected[type_dir] = merge_chip_values(module_mean_rows((loaded for _, loaded in group), means),
+                                                result_nums, streaming)
+        module_means[type_dir] = {result_num: (name, np.array(rows)) for result_num, (name, rows) in means.items()}
+    return collected, module_means
+
+def module_mean_rows(loaded_modules, means):
+    # passes the modules on, keeping only their per-test chip averages: {result_num: (name, rows)}
+    for loaded in loaded_modules:
+        if loaded:
+            for result_num, (name, values) in loaded.items():
+                row = [np.mean(test_values) if test_values else np.nan for test_values in values]
+                means.setdefault(result_num, (name, []))[1].append(row)
+        yield loaded
+
+def plot_type_means(type_means, output_path, result_name, draft=None):
+    # type name -> module x test array of chip-averaged means
+    groups = {type_name: (values, ~np.isnan(values)) for type_name, values in type_means.items()}
+    fig = plot_grouped_test_boxes(groups, f"Chip-averaged {result_name} by Test - {', '.join(groups)}",
+                                  result_ylabel(result_name), 'Test Sequence', first_test=1)
+    with stage('savefig'):
+        fig.savefig(output_path, **save_options(draft))
+    plt.close(fig)
+
+def plot_type_comparison(module_means, output_path, result_num, draft=None):
+    type_means = {}
+    result_name = None
+    for type_dir, means in module_means.items():
+        if result_num in means:
+            result_name, values = means[result_num]
+            type_means[os.path.basename(os.path.normpath(type_dir))] = values
+    if draft:
+        arrays = {f"type{i}": values for i, values in enumerate(type_means.values())}
+        record_inputs(output_path, 'type_comparison',
+                      {'result_name': result_name, 'types': list(type_means)}, arrays)
+    plot_type_means(type_means, figure_path(output_path, draft), result_name, draft)
+
+def replay_type_comparison(meta, arrays, save_path):
+    type_means = {type_name: arrays[f"type{i}"] for i, type_name in enumerate(meta['types'])}
+    plot_type_means(type_means, save_path, meta['result_name'])
+
+def compare_types(type_dirs, result_nums, output_dir, workers=1, use_threads=False, streaming=False, draft=None):
+    print("Collecting data...")
+    with stage('ingest'):
+        collected, module_means = collect_types_chip_data(type_dirs, result_nums, workers, use_threads, streaming)
+    
+    for type_dir, type_collected in collected.items():
+        type_name = os.path.basename(os.path.normpath(type_dir))
+        for chip_data, result_name in type_collected.values():
+            output_path = os.path.join(output_dir, f"{type_name}_{result_name}.png")
+            with stage('plot'):
+                plot_chip_means(chip_data, output_path, type_name, result_name, draft)
+            print(f"\nFigure saved: {figure_path(output_path, draft)}")
+    
+    stem = '_vs_'.join(os.path.basename(os.path.normpath(type_dir)) for type_dir in type_dirs)
+    result_names = {result_num: name for type_collected in collected.values()
+                    for result_num, (_, name) in type_collected.items()}
+    for result_num, result_name in sorted(result_names.items()):
+        output_path = os.path.join(output_dir, f"{stem}_{result_name}.png")
+        with stage('plot'):
+            plot_type_comparison(module_means, output_path, result_num, draft)
+        print(f"Comparison saved: {figure_path(output_path, draft)}")
+
+def sn_chip_summary(sn_path, result_nums):
+    # manifest entry of one SN; JSON object keys are strings
+    loaded = load_chip_values(sn_path, result_nums) or {}
+    return {'results': {str(result_num): [name, values] for result_num, (name, values) in loaded.items()}}
+
+def collect_chip_data_incremental(type_dir, manifest_path, result_nums='all', workers=1, use_threads=False, streaming=False):
+    # only SN directories with new, replaced or removed uploads since the last run are reparsed
+    if result_nums != 'all':
+        result_nums = [int(result_num) for result_num in result_nums]
+    key = {'type_dir': os.path.abspath(type_dir), 'result_nums': result_nums}
+    compute = partial(sn_chip_summary, result_nums=result_nums)
+    entries, changed = update_entries(load_manifest(manifest_path, key), list_sn_paths(type_dir), compute,
+                                      workers, use_threads)
+    save_manifest(manifest_path, key, entries)
+    print(f"{len(changed)} of {len(entries)} SN directories updated since the last run")
+    
+    loaded_modules = ({int(result_num): tuple(result) for result_num, result in entry['results'].items()}
+                      for entry in entries.values())
+    return merge_chip_values(loaded_modules, result_nums, streaming), changed
+
+def collect_chip_data(type_dir, result_num, workers=1, use_threads=False, streaming=False):
+    collected = collect_multi_chip_data(type_dir, [result_num], workers, use_threads, streaming)
+    return collected.get(int(result_num), (None, None))
+
+def parse_result_selection(input_str):
+    if input_str.strip().lower() == 'all':
+        return 'all'
+    result_nums = re.findall(r'\d+', input_str)
+    if not result_nums:
+        raise ValueError("Please input result indices or 'all'")
+    return [int(result_num) for result_num in result_nums]
+
+def chip_series(chip_data):
+    if isinstance(chip_data, RunningChipStats):
+        return chip_data.series()
     
+    test_numbers = sorted({tn for chip in chip_data.values() for tn in chip.keys()})
+    series = []
     for chip_idx, test_data in sorted(chip_data.items()):
         x = []
         y = []
@@ -100,14 +320,10 @@ def plot_chip_means(chip_data, output_path, type, result_name):
                 x.append(test_num)
                 y.append(np.mean(values))
                 y_err.append(np.std(values) / np.sqrt(len(values))) 
-        
-        plt.errorbar(x, y, yerr=y_err,
-                    linestyle='none',
-                    fmt='-o',
-                    label=f'Chip {chip_idx}',
-                    capsize=4,
-                    elinewidth=1.2,
-                    markersize=8)
+        series.append((chip_idx, x, y, y_err))
+    return test_numbers, series
+
+def result_ylabel(result_name):
     ylabel = "Value"
     if result_name.lower().startswith("gain"):
         ylabel = "Gain (mV/fC)"
@@ -115,36 +331,125 @@ def plot_chip_means(chip_data, output_path, type, result_name):
         ylabel = "Input noise (ENC)"
     elif result_name.lower().startswith("vt50"):
         ylabel = "Vt50 (mV)"
+    return ylabel
+
+def plot_chip_means(chip_data, output_path, type, result_name, draft=None):
+    test_numbers, series = chip_series(chip_data)
+    if draft:
+        record_chip_series(output_path, test_numbers, series, type, result_name)
+    plot_chip_series(test_numbers, series, figure_path(output_path, draft), type, result_name, draft)
+
+def record_chip_series(output_path, test_numbers, series, type, result_name):
+    meta = {'type': type, 'result_name': result_name, 'test_numbers': [int(tn) for tn in test_numbers],
+            'chips': [int(chip_idx) for chip_idx, *_ in series]}
+    arrays = {}
+    for i, (_, x, y, y_err) in enumerate(series):
+        arrays[f"x{i}"] = np.asarray(x, dtype=int)
+        arrays[f"y{i}"] = np.asarray(y, dtype=float)
+        arrays[f"err{i}"] = np.asarray(y_err, dtype=float)
+    record_inputs(output_path, 'chip_means', meta, arrays)
+
+def replay_chip_means(meta, arrays, save_path):
+    series = [(chip_idx, arrays[f"x{i}"], arrays[f"y{i}"], arrays[f"err{i}"])
+              for i, chip_idx in enumerate(meta['chips'])]
+    plot_chip_series(meta['test_numbers'], series, save_path, meta['type'], meta['result_name'])
+
+def plot_chip_series(test_numbers, series, output_path, type, result_name, draft=None):
+    output_dir = os.path.dirname(output_path)
+    os.makedirs(output_dir, exist_ok=True)
+    plt.figure(figsize=(12, 9))
+    
+    for chip_idx, x, y, y_err in series:
+        plt.errorbar(x, y, yerr=y_err,
+                    linestyle='none',
+                    fmt='-o',
+                    label=f'Chip {chip_idx}',
+                    capsize=4,
+                    elinewidth=1.2,
+                    markersize=8)
     plt.title(f"{type} Chip Performance {result_name}", fontsize=14)
     plt.xlabel('Test Sequence', fontsize=12)
-    plt.ylabel(ylabel, fontsize=12)
+    plt.ylabel(result_ylabel(result_name), fontsize=12)
     plt.xticks(test_numbers)
     plt.grid(True, linestyle=':', alpha=0.6)
     plt.legend(loc='best')
-    plt.savefig(output_path, dpi=300, bbox_inches='tight')
+    with stage('savefig'):
+        plt.savefig(output_path, **save_options(draft))
     plt.close()
 
-def main():
-    type_dir = input("Input the type directory: ").strip()
-    result_num = input("Input the results index: ").strip()
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Per-chip mean of one result over a type")
+    add_ingest_args(parser)
+    parser.add_argument('--streaming', action='store_true',
+                        help="accumulate running per-chip statistics instead of keeping every value")
+    parser.add_argument('--incremental', action='store_true',
+                        help="keep per-SN results in a manifest and only reparse SNs with new uploads")
+    add_draft_args(parser)
+    add_profile_args(parser)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    apply_ingest_args(args)
+    start_profiling(args)
+    type_dir = input("Input the type directory (several separated by commas to compare): ").strip()
+    result_nums = parse_result_selection(
+        input("Input the results index (several separated by commas, or 'all' for every 2D result): "))
     output_dir = "chip_analysis"
     os.makedirs(output_dir, exist_ok=True)
     
+    type_dirs = [directory.strip() for directory in type_dir.split(',') if directory.strip()]
+    if len(type_dirs) > 1:
+        missing = [directory for directory in type_dirs if not os.path.exists(directory)]
+        if missing:
+            print(f"Error: directory {', '.join(missing)} does not exist")
+            return
+        if args.incremental:
+            print("Warning: --incremental is not supported when comparing types, every SN is reparsed")
+        if args.compare_json:
+            for directory in type_dirs:
+                compare_backends(json_files_under(directory))
+        compare_types(type_dirs, result_nums, output_dir,
+                      workers=args.workers, use_threads=args.threads, streaming=args.streaming, draft=args.draft)
+        prune_cache()
+        finish_profiling()
+        return
+    
     if not os.path.exists(type_dir):
         print(f"Error: directory {type_dir} does not exist")
         return
+    if args.compare_json:
+        compare_backends(json_files_under(type_dir))
     
     print("Collecting data...")
-    chip_data, result_name = collect_chip_data(type_dir, result_num)
-    if chip_data is None:
-        return
-    
-    print(f"{len(chip_data)} ABCs detected")
-
     type_name = os.path.basename(type_dir.rstrip('/'))
-    output_path = os.path.join(output_dir, f"{type_name}_{result_name}.png")
-    plot_chip_means(chip_data, output_path, type_name, result_name)
-    print(f"\nFigure saved: {output_path}")
+    changed = None
+    if args.incremental:
+        manifest_path = os.path.join(output_dir, f"{type_name}_manifest.json")
+        with stage('ingest'):
+            collected, changed = collect_chip_data_incremental(type_dir, manifest_path, result_nums,
+                                                               workers=args.workers, use_threads=args.threads,
+                                                               streaming=args.streaming)
+    else:
+        with stage('ingest'):
+            collected = collect_multi_chip_data(type_dir, result_nums,
+                                                workers=args.workers, use_threads=args.threads,
+                                                streaming=args.streaming)
+    prune_cache()
+    
+    for chip_data, result_name in collected.values():
+        print(f"{len(chip_data)} ABCs detected for {result_name}")
+        output_path = os.path.join(output_dir, f"{type_name}_{result_name}.png")
+        if changed == [] and os.path.exists(figure_path(output_path, args.draft)):
+            print(f"No new uploads since the last run, {figure_path(output_path, args.draft)} is up to date")
+            continue
+        with stage('plot'):
+            plot_chip_means(chip_data, output_path, type_name, result_name, args.draft)
+        print(f"\nFigure saved: {figure_path(output_path, args.draft)}")
+    if args.draft:
+        print(f"Draft previews saved, render chosen figures at full quality with: "
+              f"python render_final.py {output_dir}/<figure>.plot.npz")
+    finish_profiling()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
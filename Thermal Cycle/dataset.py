@@ -0,0 +1,123 @@
+import os
+from pathlib import Path
+from functools import cached_property, partial
+import numpy as np
+from parallel import ordered_map
+from dir_index import load_directory_index, split_type_dir
+from channel_analysis_type import (find_latest_valid_json, load_latest_valid_json, defect_matrix,
+                                   defect_frame, aggregate_module_stats)
+from boxplot import extract, temperature, info, failed_indices, get_result_name
+from dense_store import result_array
+
+class ThermalCycleDataset:
+    # the latest valid upload of every SN of one type; each view is computed on first use and kept,
+    # so several analyses in one process share a single load
+    #
+    #   ds = ThermalCycleDataset('data/TYPEA')
+    #   ds.module_stats['TotalBad'], ds.results(1)['20USEH0000003'], ds.temperatures
+    def __init__(self, type_dir, required_test_count=25, workers=1, use_threads=False):
+        self.type_dir = Path(type_dir)
+        self.required_test_count = required_test_count
+        self.workers = workers
+        self.use_threads = use_threads
+        self._results = {}
+        self._result_arrays = {}
+        self._stacked = {}
+
+    def __repr__(self):
+        return f"ThermalCycleDataset('{self.type_dir}', {len(self.sn_dirs)} SNs)"
+
+    @cached_property
+    def sn_dirs(self):
+        root, type_name = split_type_dir(os.fspath(self.type_dir))
+        sn_paths = load_directory_index(root, [type_name]).sn_dirs(type_name)
+        return {os.path.basename(sn_path): Path(sn_path) for sn_path in sn_paths}
+
+    @cached_property
+    def latest_files(self):
+        # SN -> latest upload with the required number of tests, SNs without one are left out
+        find = partial(find_latest_valid_json, required_test_count=self.required_test_count)
+        sn_dirs = list(self.sn_dirs.values())
+        found = ordered_map(find, sn_dirs, self.workers, self.use_threads)
+        return {sn: json_file for sn, json_file in zip(self.sn_dirs, found) if json_file}
+
+    @cached_property
+    def runs(self):
+        # SN -> parsed test run of the newest upload that decodes; a broken latest upload
+        # falls back to the one before, and latest_files is set to the files actually used
+        load = partial(load_latest_valid_json, required_test_count=self.required_test_count, values='all')
+        loaded = ordered_map(load, list(self.sn_dirs.values()), self.workers, self.use_threads)
+        latest = {sn: result for sn, result in zip(self.sn_dirs, loaded) if result}
+        self.__dict__['latest_files'] = {sn: json_file for sn, (json_file, _) in latest.items()}
+        return {sn: data for sn, (_, data) in latest.items()}
+
+    @cached_property
+    def defect_matrices(self):
+        # SN -> (tests x channels boolean matrix, all_tests)
+        return {sn: defect_matrix(data) for sn, data in self.runs.items()}
+
+    @cached_property
+    def defect_frames(self):
+        return {sn: defect_frame(matrix, all_tests) for sn, (matrix, all_tests) in self.defect_matrices.items()}
+
+    @cached_property
+    def module_stats(self):
+        # per-test totals and longest runs of the modules with any bad channel, as the module plots use them
+        modules = {sn: module for sn, module in self.defect_matrices.items() if module[0].any()}
+        if not modules:
+            return None
+        return aggregate_module_stats(modules)
+
+    @cached_property
+    def temperatures(self):
+        return {sn: temperature(data) for sn, data in self.runs.items()}
+
+    @cached_property
+    def metadata(self):
+        return {sn: {
+            'file': os.fspath(self.latest_files[sn]),
+            'stateTs': data.get('stateTs'),
+            'runNumber': data.get('runNumber'),
+            'passed': data.get('passed'),
+            'failed_tests': failed_indices(data),
+            'info': info(data)
+        } for sn, data in self.runs.items()}
+
+    def result_name(self, index):
+        for data in self.runs.values():
+            name = get_result_name(data, str(index))
+            if name != "unnamed":
+                return name
+        return "unnamed"
+
+    def results(self, index):
+        # SN -> per-test lists as boxplot.extract returns them (3D results flattened over chips)
+        if index not in self._results:
+            path = ['results', str(index), 'value']
+            extracted = {sn: extract(data, path) for sn, data in self.runs.items()}
+            self._results[index] = {sn: values for sn, values in extracted.items() if values}
+        return self._results[index]
+
+    def result_arrays(self, index):
+        # SN -> (25, chips) or (25, chips, channels) array
+        if index not in self._result_arrays:
+            arrays = {sn: result_array(data, int(index))[1] for sn, data in self.runs.items()}
+            self._result_arrays[index] = {sn: values for sn, values in arrays.items() if values is not None}
+        return self._result_arrays[index]
+
+    def stacked_result(self, index):
+        # (modules, 25, ...) array padded with NaN and the SN of every row
+        if index in self._stacked:
+            return self._stacked[index]
+        arrays = self.result_arrays(index)
+        if not arrays:
+            return np.empty((0, 25)), []
+        ndims = {values.ndim for values in arrays.values()}
+        if len(ndims) > 1:
+            raise ValueError(f"Result {index} mixes 2D and 3D arrays across modules")
+        shape = tuple(np.max([values.shape for values in arrays.values()], axis=0))
+        stacked = np.full((len(arrays),) + shape, np.nan)
+        for row, values in enumerate(arrays.values()):
+            stacked[(row,) + tuple(slice(0, n) for n in values.shape)] = values
+        self._stacked[index] = (stacked, list(arrays))
+        return self._stacked[index]
@@ -0,0 +1,161 @@
+import os
+import re
+import json
+import argparse
+from functools import partial
+import numpy as np
+from parallel import ordered_map
+from result_cache import load_test_run, prune_cache
+from ingest import add_ingest_args, apply_ingest_args
+from manifest import directory_signature
+from chip_analysis import get_latest_json_per_serial, list_sn_paths
+
+STORE_VERSION = 1
+N_TESTS = 25
+DTYPES = ('float32', 'float64')
+
+def result_array(data, result_num):
+    # one result as a (25, chips) or (25, chips, channels) array; None if it is not rectangular
+    try:
+        result_entry = data['results'][result_num]
+        values = np.asarray(result_entry['value'], dtype=float)
+    except (KeyError, IndexError, TypeError, ValueError):
+        return None, None
+    if values.ndim < 2 or values.shape[0] != N_TESTS:
+        return None, None
+    return result_entry.get('name'), values
+
+def probe_module(sn_path, result_num):
+    # first pass: the upload used for this SN and the shape of its result
+    latest_json = get_latest_json_per_serial(sn_path, [result_num])
+    if not latest_json:
+        return None
+
+    _, file_path, data = latest_json
+    name, values = result_array(data, result_num)
+    if values is None:
+        print(f"{file_path} has no 25-test array for result {result_num}, skip")
+        return None
+    return {'SN': os.path.basename(sn_path), 'stateTs': data.get('stateTs'), 'file': file_path,
+            'name': name, 'shape': list(values.shape[1:])}
+
+def load_module_array(file_path, result_num):
+    return result_array(load_test_run(file_path, [result_num]), result_num)[1]
+
+def store_paths(output_dir, type_name, result_num):
+    stem = os.path.join(output_dir, f"{type_name}_r{result_num}")
+    return f"{stem}.npy", f"{stem}.json"
+
+def read_index(index_path):
+    try:
+        with open(index_path, 'r') as f:
+            index = json.load(f)
+        if index.get('version') == STORE_VERSION:
+            return index
+    except (OSError, ValueError):
+        pass
+    return None
+
+def write_index(index_path, index):
+    tmp = f"{index_path}.{os.getpid()}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(index, f, indent=1)
+    os.replace(tmp, index_path)
+
+def pack_type(type_dir, result_num, output_dir='dense_store', dtype='float64', workers=1, use_threads=False):
+    # every module of a type in one (modules, 25, chips[, channels]) .npy, padded with NaN,
+    # plus a JSON index of SN, stateTs and source file per row
+    if dtype not in DTYPES:
+        raise ValueError(f"dtype must be one of {DTYPES}")
+    type_name = os.path.basename(os.path.normpath(type_dir))
+    array_path, index_path = store_paths(output_dir, type_name, result_num)
+    sn_paths = list_sn_paths(type_dir)
+    signatures = {os.path.basename(sn_path): directory_signature(sn_path) for sn_path in sn_paths}
+
+    index = read_index(index_path)
+    if (index and index['signatures'] == signatures and index['dtype'] == dtype
+            and os.path.exists(array_path)):
+        print(f"No new uploads since the last run, {array_path} is up to date")
+        return array_path, index_path
+
+    probe = partial(probe_module, result_num=result_num)
+    modules = [module for module in ordered_map(probe, sn_paths, workers, use_threads) if module]
+    if not modules:
+        print(f"No module of {type_name} has a 25-test array for result {result_num}")
+        return None
+    if len({len(module['shape']) for module in modules}) > 1:
+        raise ValueError(f"Result {result_num} mixes 2D and 3D arrays across modules")
+
+    inner_shape = tuple(int(n) for n in np.max([module['shape'] for module in modules], axis=0))
+    shape = (len(modules), N_TESTS) + inner_shape
+    os.makedirs(output_dir, exist_ok=True)
+    tmp_path = f"{array_path}.{os.getpid()}.tmp"
+    store = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=dtype, shape=shape)
+
+    # rows are written one module at a time, so memory use does not grow with the type
+    load = partial(load_module_array, result_num=result_num)
+    for row, values in enumerate(ordered_map(load, [module['file'] for module in modules], workers, use_threads)):
+        store[row] = np.nan
+        store[(row, slice(None)) + tuple(slice(0, n) for n in values.shape[1:])] = values
+    store.flush()
+    del store
+    os.replace(tmp_path, array_path)
+
+    write_index(index_path, {
+        'version': STORE_VERSION,
+        'type_dir': os.path.abspath(type_dir),
+        'result_num': result_num,
+        'result_name': modules[0]['name'],
+        'dtype': dtype,
+        'shape': list(shape),
+        'modules': [{key: module[key] for key in ('SN', 'stateTs', 'file', 'shape')} for module in modules],
+        'signatures': signatures
+    })
+    return array_path, index_path
+
+def open_store(array_path):
+    # read-only memory map: slicing touches only the pages it needs
+    index = read_index(os.path.splitext(array_path)[0] + '.json')
+    if index is None:
+        raise FileNotFoundError(f"No index found for {array_path}")
+    return np.load(array_path, mmap_mode='r'), index
+
+def module_rows(index, sns):
+    rows = {module['SN']: row for row, module in enumerate(index['modules'])}
+    return [rows[sn] for sn in sns]
+
+def flatten_chips(store):
+    # (modules, 25, chips * channels) view, the layout boxplot.extract builds from 3D results
+    return store.reshape(store.shape[0], N_TESTS, -1)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Pack one result of every module of a type into a memory-mapped array")
+    parser.add_argument('--output-dir', default='dense_store',
+                        help="where the .npy array and its .json index are written")
+    parser.add_argument('--dtype', choices=DTYPES, default='float64',
+                        help="element type of the packed array")
+    add_ingest_args(parser, json_options=False)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    apply_ingest_args(args)
+    type_dir = input("Input the type directory: ").strip()
+    result_num = re.findall(r'\d+', input("Input the results index: "))
+    if len(result_num) != 1:
+        raise ValueError("Please input a number")
+
+    if not os.path.exists(type_dir):
+        print(f"Error: directory {type_dir} does not exist")
+        return
+
+    packed = pack_type(type_dir, int(result_num[0]), args.output_dir, args.dtype,
+                       workers=args.workers, use_threads=args.threads)
+    prune_cache()
+    if packed:
+        store, index = open_store(packed[0])
+        print(f"{index['result_name']}: {store.shape} {store.dtype} for {len(index['modules'])} modules")
+        print(f"Array saved to: {packed[0]}\nIndex saved to: {packed[1]}")
+
+if __name__ == "__main__":
+    main()
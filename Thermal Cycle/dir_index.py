@@ -0,0 +1,181 @@
+import os
+import json
+import hashlib
+from result_cache import cache_enabled, cache_dir
+from profiling import count
+
+INDEX_VERSION = 1
+
+def scan_subdirs(path):
+    count('directory_listings')
+    with os.scandir(path) as it:
+        return {entry.name: entry.stat().st_mtime_ns for entry in it if entry.is_dir()}
+
+def stat_subdirs(parent, names):
+    # mtimes of known subdirectories, without listing parent; vanished ones are dropped
+    mtimes = {}
+    for name in names:
+        try:
+            mtimes[name] = os.stat(os.path.join(parent, name)).st_mtime_ns
+        except FileNotFoundError:
+            continue
+    return mtimes
+
+def scan_json_files(path):
+    count('directory_listings')
+    files = {}
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.name.endswith('.json') and entry.is_file():
+                stat = entry.stat()
+                files[entry.name] = [stat.st_size, stat.st_mtime_ns]
+    return files
+
+class DirectoryIndex:
+    # type -> SN -> JSON files below root; directories are only listed again when their own
+    # mtime changed, i.e. when entries were added or removed. The stored file size/mtime are
+    # those of the last listing and miss files rewritten in place, stat files that must be current
+    def __init__(self, root=''):
+        self.root = root
+        self.types = {}
+        self.mtime = None
+        self.changed = False
+
+    def path(self, *parts):
+        return os.path.join(self.root, *parts)
+
+    def index_path(self):
+        key = hashlib.sha1(os.path.abspath(self.root).encode('utf-8')).hexdigest()
+        return os.path.join(cache_dir(), 'dirs', f"{key}.json")
+
+    def load(self):
+        if not cache_enabled():
+            return
+        try:
+            with open(self.index_path(), 'r') as f:
+                saved = json.load(f)
+            if saved.get('version') == INDEX_VERSION:
+                self.types = saved['types']
+                self.mtime = saved['mtime']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def save(self):
+        if not cache_enabled() or not self.changed:
+            return
+        path = self.index_path()
+        tmp = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp, 'w') as f:
+                json.dump({'version': INDEX_VERSION, 'mtime': self.mtime, 'types': self.types}, f)
+            os.replace(tmp, path)
+            self.changed = False
+        except OSError as e:
+            print(f"Directory index write failed for {self.root or '.'}: {str(e)}")
+
+    def refresh_serials(self, type_name, mtime):
+        entry = self.types.setdefault(type_name, {'mtime': None, 'serials': {}})
+        if entry['mtime'] == mtime:
+            serial_mtimes = stat_subdirs(self.path(type_name), entry['serials'])
+        else:
+            serial_mtimes = scan_subdirs(self.path(type_name))
+            entry['mtime'] = mtime
+            self.changed = True
+
+        serials = {}
+        for sn, sn_mtime in serial_mtimes.items():
+            known = entry['serials'].get(sn)
+            if known is None or known['mtime'] != sn_mtime:
+                known = {'mtime': sn_mtime, 'files': scan_json_files(self.path(type_name, sn))}
+                self.changed = True
+            serials[sn] = known
+        if len(serials) != len(entry['serials']):
+            self.changed = True
+        entry['serials'] = dict(sorted(serials.items()))
+
+    def refresh_serial(self, type_name, sn):
+        # one SN directory: a stat, and a listing only when its mtime changed
+        entry = self.types.setdefault(type_name, {'mtime': None, 'serials': {}})
+        try:
+            sn_mtime = os.stat(self.path(type_name, sn)).st_mtime_ns
+        except FileNotFoundError:
+            if entry['serials'].pop(sn, None) is not None:
+                self.changed = True
+            return
+        known = entry['serials'].get(sn)
+        if known is None or known['mtime'] != sn_mtime:
+            entry['serials'][sn] = {'mtime': sn_mtime, 'files': scan_json_files(self.path(type_name, sn))}
+            entry['serials'] = dict(sorted(entry['serials'].items()))
+            self.changed = True
+
+    def refresh_types(self):
+        # the type directories are listed again only when root's mtime changed
+        root_mtime = os.stat(self.root or '.').st_mtime_ns
+        if self.mtime != root_mtime:
+            type_mtimes = scan_subdirs(self.root or '.')
+            self.types = {name: self.types.get(name, {'mtime': None, 'serials': {}}) for name in sorted(type_mtimes)}
+            self.mtime = root_mtime
+            self.changed = True
+
+    def refresh(self, type_names=None):
+        # type_names limits the refresh to some types, e.g. when only one type is analysed;
+        # the SN directories of the other types are not looked at
+        self.refresh_types()
+        for type_name in (list(self.types) if type_names is None else type_names):
+            try:
+                mtime = os.stat(self.path(type_name)).st_mtime_ns
+            except FileNotFoundError:
+                if self.types.pop(type_name, None) is not None:
+                    self.changed = True
+                continue
+            self.refresh_serials(type_name, mtime)
+
+    def serials(self, type_name):
+        entry = self.types.get(type_name)
+        return list(entry['serials']) if entry else []
+
+    def sn_dirs(self, type_name):
+        return [self.path(type_name, sn) for sn in self.serials(type_name)]
+
+    def files(self, type_name=None, sn=None):
+        # JSON paths for a type, an SN (in every type) or both
+        if type_name is not None:
+            pairs = [(type_name, s) for s in ([sn] if sn is not None else self.serials(type_name))]
+        elif sn is not None:
+            pairs = [(t, sn) for t in self.types if sn in self.types[t]['serials']]
+        else:
+            pairs = [(t, s) for t in self.types for s in self.serials(t)]
+
+        paths = []
+        for t, s in pairs:
+            serial = self.types.get(t, {'serials': {}})['serials'].get(s)
+            if serial:
+                paths.extend(self.path(t, s, name) for name in sorted(serial['files']))
+        return paths
+
+def load_directory_index(root='', type_names=None):
+    index = DirectoryIndex(root)
+    index.load()
+    index.refresh(type_names)
+    index.save()
+    return index
+
+def find_serial_files(root='', sn=None, type_name=None):
+    # JSON files of one SN, in one type or in every known type, looking only at root/type/sn
+    index = DirectoryIndex(root)
+    index.load()
+    if type_name is None:
+        index.refresh_types()
+        type_names = list(index.types)
+    else:
+        type_names = [type_name]
+    for name in type_names:
+        index.refresh_serial(name, sn)
+    index.save()
+    return index.files(type_name, sn)
+
+def split_type_dir(type_dir):
+    # 'data/TYPEA/' -> index of 'data' and type 'TYPEA'
+    type_dir = os.path.normpath(type_dir)
+    return os.path.dirname(type_dir), os.path.basename(type_dir)
@@ -0,0 +1,51 @@
+import os
+import json
+import numpy as np
+
+DRAFT_DPI = 72
+FINAL_DPI = 300
+DRAFT_FORMATS = ('png', 'svg')
+INPUTS_SUFFIX = '.plot.npz'
+
+def save_options(draft=None):
+    # draft is None for publication quality, otherwise the preview format;
+    # previews also skip bbox_inches='tight', which costs an extra layout pass
+    if draft is None:
+        return {'dpi': FINAL_DPI, 'bbox_inches': 'tight'}
+    if draft == 'svg':
+        return {'format': 'svg'}
+    return {'dpi': DRAFT_DPI}
+
+def figure_path(path, draft=None):
+    if draft == 'svg':
+        return os.path.splitext(path)[0] + '.svg'
+    return path
+
+def inputs_path(path):
+    return os.path.splitext(path)[0] + INPUTS_SUFFIX
+
+def record_inputs(path, kind, meta, arrays):
+    # the plot function arguments next to the preview, so the final render never opens a test-run JSON
+    meta = dict(meta, kind=kind, figure=os.path.abspath(path))
+    output = inputs_path(path)
+    tmp = f"{output}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(tmp, 'wb') as f:
+            np.savez(f, meta=np.array(json.dumps(meta)), **arrays)
+        os.replace(tmp, output)
+    except OSError as e:
+        print(f"Could not record the plot inputs of {path}: {str(e)}")
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+def load_inputs(path):
+    with np.load(path, allow_pickle=False) as npz:
+        meta = json.loads(str(npz['meta']))
+        arrays = {name: npz[name] for name in npz.files if name != 'meta'}
+    return meta, arrays
+
+def add_draft_args(parser):
+    parser.add_argument('--draft', nargs='?', const='png', choices=DRAFT_FORMATS, default=None,
+                        help=f"fast previews ({DRAFT_DPI} dpi PNG, or SVG) and record the plot inputs "
+                             "for render_final.py")
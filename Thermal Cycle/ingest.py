@@ -0,0 +1,28 @@
+from result_cache import configure
+from parallel import configure_read_ahead
+from json_backend import BACKENDS, configure_backend
+
+WORKERS_HELP = "number of SN directories ingested in parallel (0: all cores)"
+
+def add_ingest_args(parser, workers_help=WORKERS_HELP, threads=True, json_options=True):
+    # how the test-run JSON files are read, shared by the analysis scripts
+    parser.add_argument('--workers', type=int, default=1, help=workers_help)
+    if threads:
+        parser.add_argument('--threads', action='store_true',
+                            help="use a thread pool instead of a process pool (I/O-bound storage)")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="always decode the JSON files, bypassing the parsed-result cache")
+    parser.add_argument('--cache-dir', default=None,
+                        help="location of the parsed-result cache")
+    if json_options:
+        parser.add_argument('--json-backend', choices=BACKENDS, default='auto',
+                            help="JSON decoder for the test-run files (auto: orjson when installed)")
+        parser.add_argument('--compare-json', action='store_true',
+                            help="time every available JSON backend on the input files before the analysis")
+        parser.add_argument('--read-ahead', type=int, default=None, metavar='N',
+                            help="number of upcoming JSON files read in background threads (default 4, 0: off)")
+
+def apply_ingest_args(args):
+    configure(enabled=not args.no_cache, cache_dir=args.cache_dir)
+    configure_backend(getattr(args, 'json_backend', None))
+    configure_read_ahead(getattr(args, 'read_ahead', None))
@@ -0,0 +1,79 @@
+import os
+import json
+import time
+from profiling import count
+from parallel import set_worker_setting
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKENDS = ('auto', 'orjson', 'json')
+
+def configure_backend(name=None):
+    if name is None:
+        return
+    if name not in BACKENDS:
+        raise ValueError(f"JSON backend must be one of {BACKENDS}")
+    if name == 'orjson' and orjson is None:
+        print("orjson is not installed, falling back to json")
+    set_worker_setting('TC_JSON_BACKEND', name)
+
+def backend_name():
+    if os.environ.get('TC_JSON_BACKEND', 'auto') != 'json' and orjson is not None:
+        return 'orjson'
+    return 'json'
+
+def available_backends():
+    return ['json'] if orjson is None else ['orjson', 'json']
+
+def loads(raw, backend=None):
+    if (backend or backend_name()) == 'orjson':
+        try:
+            return orjson.loads(raw)
+        except orjson.JSONDecodeError:
+            pass            # NaN/Infinity literals or integers beyond 64 bit: json accepts them
+    return json.loads(raw)
+
+def load_file(path, backend=None):
+    with open(path, 'rb') as f:
+        raw = f.read()
+    count('json_files')
+    count('json_bytes', len(raw))
+    return loads(raw, backend)
+
+def json_files_under(directory):
+    found = []
+    for root, _, files in os.walk(directory):
+        found.extend(os.path.join(root, f) for f in files if f.endswith('.json'))
+    return sorted(found)
+
+def compare_backends(paths, max_files=20):
+    # decode time of each backend over the same bytes, file reading excluded
+    raws = []
+    for path in paths[:max_files]:
+        with open(path, 'rb') as f:
+            raws.append(f.read())
+    if not raws:
+        print("No JSON file to time")
+        return {}
+
+    timings = {}
+    decoded = {}
+    for backend in available_backends():
+        start = time.perf_counter()
+        decoded[backend] = [loads(raw, backend) for raw in raws]
+        timings[backend] = time.perf_counter() - start
+
+    size_mb = sum(len(raw) for raw in raws) / 1e6
+    print(f"\nJSON decode of {len(raws)} files ({size_mb:.1f} MB):")
+    for backend, seconds in timings.items():
+        print(f"  {backend:7s} {seconds:8.3f} s  {size_mb / max(seconds, 1e-9):8.1f} MB/s")
+    if 'orjson' in timings:
+        same = decoded['orjson'] == decoded['json']
+        print(f"  orjson is {timings['json'] / max(timings['orjson'], 1e-9):.1f}x faster, "
+              f"results {'identical' if same else 'DIFFER'}")
+    else:
+        print("  orjson is not installed, only json is available")
+    return timings
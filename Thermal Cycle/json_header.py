@@ -0,0 +1,204 @@
+import os
+import re
+import json
+import codecs
+import hashlib
+from json.decoder import scanstring
+from result_cache import cache_enabled, cache_dir
+from profiling import count
+
+HEADER_VERSION = 1
+HEADER_KEYS = ('stateTs', 'properties')
+SKIP_CHUNK = 1 << 16
+HEAD_CHUNK = 1 << 14
+TAIL_CHUNK = 1 << 12
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+STRING = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"')
+SCALAR = re.compile(r'[^,\]}\s]*')
+# numbers never match, so long numeric arrays are skipped inside the regex engine
+STRUCTURE = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"|[\[\]{}]')
+# stateTs as the last member of the top-level object, where PDB exports put it
+TRAILING_STATE_TS = re.compile(r'"stateTs"\s*:\s*("[^"\\]*(?:\\.[^"\\]*)*"|null)\s*}\s*$')
+decoder = json.JSONDecoder()
+
+def skip_value(text, pos):
+    # only used for top-level members: once a value closes, the next structural
+    # character is a '"' (next key) or the final '}', never an opening bracket
+    char = text[pos]
+    if char == '"':
+        return STRING.match(text, pos).end()
+    if char not in '[{':
+        return SCALAR.match(text, pos).end()
+
+    depth = 0
+    while pos < len(text):
+        end = min(pos + SKIP_CHUNK, len(text))
+        if text.find('"', pos, end) == -1:      # purely numeric stretch: count brackets in C
+            delta = (text.count('[', pos, end) + text.count('{', pos, end)
+                     - text.count(']', pos, end) - text.count('}', pos, end))
+            if depth + delta > 0:
+                depth += delta
+                pos = end
+                continue
+
+        for match in STRUCTURE.finditer(text, pos):
+            token = match.group()
+            if token == '[' or token == '{':
+                depth += 1
+            elif token == ']' or token == '}':
+                depth -= 1
+                if depth == 0:
+                    return match.end()
+            if match.end() >= end:
+                pos = match.end()
+                break
+        else:
+            break
+    raise ValueError("Unterminated value")
+
+def scan_members(text, keys, found, pos=0, final=True):
+    # decode the requested top-level members from pos on into found; returns (pos, done).
+    # On a partial text (final=False) the scan stops before the first member that is cut off,
+    # so that it can resume there once more of the file has been read
+    if pos == 0:
+        try:
+            pos = WHITESPACE.match(text, 0).end()
+            if text[pos] != '{':
+                raise ValueError("Top level is not a JSON object")
+        except IndexError:
+            if final:
+                raise
+            return 0, False
+        pos += 1
+
+    while len(found) < len(keys):
+        start = pos
+        try:
+            pos = WHITESPACE.match(text, pos).end()
+            if text[pos] == '}':
+                return pos, True
+            if text[pos] != '"':
+                raise ValueError(f"Expecting property name at {pos}")
+            key, pos = scanstring(text, pos + 1)
+            pos = WHITESPACE.match(text, pos).end()
+            if text[pos] != ':':
+                raise ValueError(f"Expecting ':' at {pos}")
+            pos = WHITESPACE.match(text, pos + 1).end()
+
+            if key in keys:
+                value, pos = decoder.raw_decode(text, pos)
+            else:
+                value, pos = None, skip_value(text, pos)
+
+            pos = WHITESPACE.match(text, pos).end()
+            if text[pos] == ',':
+                pos += 1
+            elif text[pos] != '}':
+                raise ValueError(f"Expecting ',' delimiter at {pos}")
+        except (ValueError, IndexError, AttributeError):
+            if final:
+                raise
+            return start, False
+        if key in keys:
+            found[key] = value
+    return pos, True
+
+def trailing_state_ts(f, size):
+    # (True, stateTs) when the file ends with it, the read position is left unchanged
+    here = f.tell()
+    f.seek(max(0, size - TAIL_CHUNK))
+    tail = f.read()
+    f.seek(here)
+    count('header_bytes', len(tail))
+    match = TRAILING_STATE_TS.search(tail.decode('utf-8', errors='replace'))
+    return (True, json.loads(match.group(1))) if match else (False, None)
+
+def scan_top_level_file(path, keys):
+    # reads the head in doubling chunks and stops once every key is decoded; stateTs is
+    # taken from the file's tail, so the results and defects in between are never read
+    found = {}
+    text = ''
+    pos = 0
+    chunk = HEAD_CHUNK
+    tail_tried = False
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        while True:
+            data = f.read(chunk)
+            final = len(data) < chunk
+            count('header_bytes', len(data))
+            text += utf8.decode(data, final=final)
+            try:
+                pos, done = scan_members(text, keys, found, pos, final)
+            except (ValueError, IndexError, AttributeError):
+                return json.loads(text)         # let the full decoder report what is wrong
+            if done or final:
+                return found
+            if not tail_tried and 'stateTs' in keys and set(found) == set(keys) - {'stateTs'}:
+                tail_tried = True
+                at_end, state_ts = trailing_state_ts(f, size)
+                if at_end:
+                    found['stateTs'] = state_ts
+                    return found
+            chunk *= 2
+
+def scan_header(path):
+    count('header_scans')
+    top = scan_top_level_file(path, HEADER_KEYS)
+
+    try:
+        n_tests = len(top['properties'][3]['value']['all_tests'])
+    except (KeyError, IndexError, TypeError):
+        n_tests = None
+    state_ts = top.get('stateTs') if isinstance(top, dict) else None
+    return {'stateTs': state_ts, 'n_tests': n_tests}
+
+def index_path(directory):
+    key = hashlib.sha1(os.path.abspath(directory).encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir(), 'headers', f"{key}.json")
+
+def load_header_index(directory):
+    index = {'directory': os.fspath(directory), 'entries': {}, 'used': {}, 'changed': False}
+    if not cache_enabled():
+        return index
+    try:
+        with open(index_path(directory), 'r') as f:
+            saved = json.load(f)
+        if saved.get('version') == HEADER_VERSION:
+            index['entries'] = saved['entries']
+    except (OSError, ValueError, KeyError):
+        pass
+    return index
+
+def read_header(path, index=None):
+    # stateTs and number of tests of a test-run JSON, without decoding the results
+    if index is None:
+        return scan_header(path)
+
+    stat = os.stat(path)
+    name = os.path.basename(path)
+    entry = index['entries'].get(name)
+    if entry is None or entry['size'] != stat.st_size or entry['mtime_ns'] != stat.st_mtime_ns:
+        header = scan_header(path)
+        entry = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, **header}
+        index['changed'] = True
+    index['used'][name] = entry
+    return {'stateTs': entry['stateTs'], 'n_tests': entry['n_tests']}
+
+def save_header_index(index):
+    # only files seen in this pass are kept, so deleted uploads drop out
+    if not cache_enabled():
+        return
+    if not index['changed'] and len(index['used']) == len(index['entries']):
+        return
+    path = index_path(index['directory'])
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp, 'w') as f:
+            json.dump({'version': HEADER_VERSION, 'entries': index['used']}, f)
+        os.replace(tmp, path)
+    except OSError as e:
+        print(f"Header index write failed for {index['directory']}: {str(e)}")
@@ -0,0 +1,51 @@
+import os
+import json
+from parallel import ordered_map
+
+MANIFEST_VERSION = 1
+
+def directory_signature(sn_dir):
+    # name, size and mtime of every JSON upload: changes whenever a file is added, replaced or removed
+    signature = []
+    with os.scandir(sn_dir) as it:
+        for entry in it:
+            if entry.name.endswith('.json') and entry.is_file():
+                stat = entry.stat()
+                signature.append([entry.name, stat.st_size, stat.st_mtime_ns])
+    return sorted(signature)
+
+def load_manifest(path, key):
+    # per-SN entries of the previous run, or nothing if it was made with other options
+    try:
+        with open(path, 'r') as f:
+            manifest = json.load(f)
+        if manifest.get('version') == MANIFEST_VERSION and manifest.get('key') == key:
+            return manifest['entries']
+    except (OSError, ValueError, KeyError):
+        pass
+    return {}
+
+def save_manifest(path, key, entries):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump({'version': MANIFEST_VERSION, 'key': key, 'entries': entries}, f)
+    os.replace(tmp, path)
+
+def update_entries(entries, sn_dirs, compute, workers=1, use_threads=False):
+    # recompute only SN directories whose uploads changed; returns (entries, changed SNs)
+    names = [os.path.basename(os.fspath(sn_dir)) for sn_dir in sn_dirs]
+    signatures = {name: directory_signature(sn_dir) for name, sn_dir in zip(names, sn_dirs)}
+    stale = [(name, sn_dir) for name, sn_dir in zip(names, sn_dirs)
+             if entries.get(name, {}).get('signature') != signatures[name]]
+
+    updated = {sn: entry for sn, entry in entries.items() if sn in signatures}
+    changed = sorted(set(entries) - set(signatures))
+    recomputed = ordered_map(compute, [sn_dir for _, sn_dir in stale], workers, use_threads)
+    for (sn, _), entry in zip(stale, recomputed):
+        entry['signature'] = signatures[sn]
+        updated[sn] = entry
+        changed.append(sn)
+
+    ordered = {sn: updated[sn] for sn in sorted(updated)}
+    return ordered, sorted(changed)
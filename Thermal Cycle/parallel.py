@@ -0,0 +1,67 @@
+import os
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+
+def resolve_workers(workers):
+    if workers is None:
+        return 1
+    if workers <= 0:                    # 0 or negative: use every core
+        return os.cpu_count() or 1
+    return workers
+
+def ordered_map(func, items, workers=1, use_threads=False, max_pending=None):
+    # results come back in the order of items, whatever the worker count;
+    # items are consumed lazily and at most max_pending jobs are in flight
+    workers = resolve_workers(workers)
+    if workers == 1:
+        for item in items:
+            yield func(item)
+        return
+
+    if use_threads:
+        pool = ThreadPoolExecutor(max_workers=workers)
+    else:
+        # spawned, not forked: read-ahead and profiler threads may hold locks at fork time,
+        # and spawn is what Windows does anyway; the TC_* settings arrive through the environment
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    limit = max_pending or 2 * workers
+    pending = deque()
+    with pool:
+        for item in items:
+            pending.append(pool.submit(func, item))
+            if len(pending) >= limit:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+DEFAULT_READ_AHEAD = 4
+
+def set_worker_setting(name, value):
+    # settings that pool workers must share live in the environment, which every worker inherits
+    if value is not None:
+        os.environ[name] = str(value)
+
+def configure_read_ahead(depth=None):
+    set_worker_setting('TC_READ_AHEAD', depth)
+
+def read_ahead_depth():
+    return int(os.environ.get('TC_READ_AHEAD', DEFAULT_READ_AHEAD))
+
+def read_ahead(load, paths, depth=None):
+    # load upcoming files in background threads while the caller works on the current one;
+    # at most depth loaded files wait in memory, and a failed load is handed over as the error
+    # in place of the result: yields (path, result, error) in the order of paths
+    def attempt(path):
+        try:
+            return path, load(path), None
+        except Exception as e:
+            return path, None, e
+
+    if depth is None:
+        depth = read_ahead_depth()
+    if depth <= 0:
+        return (attempt(path) for path in paths)
+    # one more job than depth: depth files keep loading while the caller holds the current one
+    return ordered_map(attempt, paths, depth + 1, use_threads=True, max_pending=depth + 1)
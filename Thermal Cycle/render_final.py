@@ -0,0 +1,70 @@
+import os
+import argparse
+from functools import partial
+import matplotlib
+matplotlib.use('Agg')
+from parallel import ordered_map
+from draft import INPUTS_SUFFIX, inputs_path, load_inputs
+from profiling import stage, add_profile_args, start_profiling, finish_profiling
+from boxplot import replay_boxplot
+from chip_analysis import replay_chip_means, replay_type_comparison
+
+REPLAY = {
+    'boxplot': replay_boxplot,
+    'chip_means': replay_chip_means,
+    'type_comparison': replay_type_comparison,
+}
+
+def input_files(paths):
+    # recorded inputs given directly, through their preview figure, or every one under a directory
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files.extend(os.path.join(root, name) for name in sorted(names) if name.endswith(INPUTS_SUFFIX))
+        elif path.endswith(INPUTS_SUFFIX):
+            files.append(path)
+        else:
+            files.append(inputs_path(path))
+    return files
+
+def render_final(path, output_dir=None):
+    try:
+        with stage('load'):
+            meta, arrays = load_inputs(path)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Error reading {path}: {str(e)}")
+        return None
+    save_path = meta['figure']
+    if output_dir:
+        save_path = os.path.join(output_dir, os.path.basename(save_path))
+    with stage('render'):
+        REPLAY[meta['kind']](meta, arrays, save_path)
+    return save_path
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Render recorded draft figures at publication quality")
+    parser.add_argument('paths', nargs='+',
+                        help="*.plot.npz files written by --draft, their preview figures, or directories")
+    parser.add_argument('--output-dir', default=None,
+                        help="write the figures here instead of next to their previews")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="number of processes rendering figures (0: all cores)")
+    add_profile_args(parser)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    start_profiling(args)
+    files = input_files(args.paths)
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+    rendered = 0
+    for save_path in ordered_map(partial(render_final, output_dir=args.output_dir), files, args.workers):
+        if save_path:
+            rendered += 1
+    print(f"{rendered} of {len(files)} figures rendered at full quality")
+    finish_profiling()
+
+if __name__ == "__main__":
+    main()
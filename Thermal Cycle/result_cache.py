@@ -0,0 +1,176 @@
+import os
+import json
+import hashlib
+import numpy as np
+from json_backend import load_file
+from parallel import set_worker_setting
+from profiling import count
+
+CACHE_VERSION = 1
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'thermal_cycle')
+DEFAULT_MAX_MB = 2048
+
+# the parts of an ITk test-run JSON read by boxplot, chip_analysis and channel_analysis_type
+KEEP_PATHS = [
+    ['stateTs'],
+    ['runNumber'],
+    ['passed'],
+    ['testType', 'name'],
+    ['institution', 'name'],
+    ['components', '0', 'ancestorMap', 'parent', 'component', 'type', 'code'],
+    ['components', '0', 'ancestorMap', 'parent', 'component', 'serialNumber'],
+    ['properties', '0', 'value', 'AMAC_NTCy'],
+    ['properties', '1', 'value', 'DUT_type'],
+    ['properties', '1', 'value', 'name'],
+    ['properties', '3', 'value', 'all_tests'],
+    ['properties', '3', 'value', 'failed_tests'],
+    ['properties', '4', 'value', 'points'],
+    ['results', '*', 'name'],
+    ['results', '*', 'arrayDimensions'],
+    ['results', '*', 'value'],
+    ['defects', '*', 'properties'],
+]
+
+def configure(enabled=None, cache_dir=None, max_mb=None):
+    set_worker_setting('TC_CACHE', None if enabled is None else int(bool(enabled)))
+    set_worker_setting('TC_CACHE_DIR', cache_dir)
+    set_worker_setting('TC_CACHE_MAX_MB', max_mb)
+
+def cache_enabled():
+    return os.environ.get('TC_CACHE', '1') != '0'
+
+def cache_dir():
+    return os.environ.get('TC_CACHE_DIR') or DEFAULT_CACHE_DIR
+
+def max_cache_bytes():
+    return int(float(os.environ.get('TC_CACHE_MAX_MB', DEFAULT_MAX_MB)) * 1024 * 1024)
+
+def prune_document(node, paths):
+    by_key = {}
+    for path in paths:
+        if path:
+            by_key.setdefault(path[0], []).append(path[1:])
+
+    if isinstance(node, list):          # keep list positions so that indexed paths still resolve
+        pruned = [{} if isinstance(item, dict) else None for item in node]
+        for key, rest in by_key.items():
+            if key != '*' and not key.isdigit():
+                continue
+            indices = range(len(node)) if key == '*' else [int(key)]
+            for i in indices:
+                if i < len(node):
+                    pruned[i] = prune_document(node[i], rest) if all(rest) else node[i]
+        return pruned
+
+    if isinstance(node, dict):
+        pruned = {}
+        for key, rest in by_key.items():
+            if key in node:
+                pruned[key] = prune_document(node[key], rest) if all(rest) else node[key]
+        return pruned
+
+    return node
+
+def entry_path(path):
+    key = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir(), f"{key}.npz")
+
+def to_array(value):
+    try:
+        array = np.asarray(value)
+    except ValueError:                  # ragged
+        return None
+    if array.dtype.kind not in 'iuf' or array.ndim == 0:
+        return None
+    return array
+
+def read_entry(path, stat, values='all'):
+    entry = entry_path(path)
+    try:
+        with np.load(entry, allow_pickle=False) as npz:
+            meta = json.loads(str(npz['meta']))
+            if (meta['version'] != CACHE_VERSION or meta['size'] != stat.st_size
+                    or meta['mtime_ns'] != stat.st_mtime_ns):
+                return None
+            doc = meta['doc']
+            # nested lists are only built for the results the caller reads
+            for i, result in enumerate(doc.get('results', [])):
+                if isinstance(result, dict) and f"r{i}" in npz.files and (values == 'all' or i in values):
+                    result['value'] = npz[f"r{i}"].tolist()
+        os.utime(entry)                 # least-recently-used bookkeeping for prune_cache
+        count('cache_hits')
+        return doc
+    except (OSError, ValueError, KeyError):
+        return None
+
+def write_entry(path, stat, doc):
+    entry = entry_path(path)
+    skeleton = dict(doc)
+    arrays = {}
+    results = []
+    for i, result in enumerate(doc.get('results', []) or []):
+        array = to_array(result.get('value')) if isinstance(result, dict) else None
+        if array is not None:
+            result = dict(result, value=None)
+            arrays[f"r{i}"] = array
+        results.append(result)
+    if 'results' in doc:
+        skeleton['results'] = results
+
+    meta = {'version': CACHE_VERSION, 'path': os.path.abspath(path),
+            'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'doc': skeleton}
+    tmp = f"{entry}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        with open(tmp, 'wb') as f:
+            np.savez(f, meta=np.array(json.dumps(meta)), **arrays)
+        os.replace(tmp, entry)
+    except OSError as e:
+        print(f"Cache write failed for {path}: {str(e)}")
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+def load_test_run(path, values='all'):
+    # values: 'all' or the result indices whose 'value' is needed; on a cache hit the
+    # other results keep value None
+    path = os.fspath(path)
+    if not cache_enabled():
+        return load_file(path)
+
+    stat = os.stat(path)
+    doc = read_entry(path, stat, values)
+    if doc is not None:
+        return doc
+
+    doc = prune_document(load_file(path), KEEP_PATHS)
+    write_entry(path, stat, doc)
+    return doc
+
+def prune_cache(max_bytes=None):
+    # evict least recently used entries until the cache fits in max_bytes
+    if max_bytes is None:
+        max_bytes = max_cache_bytes()
+    directory = cache_dir()
+    if not os.path.isdir(directory):
+        return 0
+
+    entries = []
+    total = 0
+    with os.scandir(directory) as it:
+        for entry in it:
+            if entry.name.endswith('.npz') and entry.is_file():
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+
+    removed = 0
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+            removed += 1
+        except OSError:
+            continue
+    return removed
@@ -0,0 +1,118 @@
+import os
+import json
+import zlib
+import argparse
+from datetime import datetime, timedelta
+import numpy as np
+from channel_analysis_type import WARM_TESTS
+
+N_TESTS = 25
+TEST_TYPES = ['STROBE_DELAY', 'THREE_POINT_GAIN', 'NO_PPA', 'RESPONSE_CURVE', 'NO_PPA']
+# name, arrayDimensions, mean, spread
+RESULTS = [
+    ('gain_away', 2, 100.0, 5.0),
+    ('innse_away', 3, 600.0, 30.0),
+    ('vt50_away', 2, 50.0, 5.0),
+    ('gain_under', 2, 98.0, 5.0),
+    ('innse_under', 3, 620.0, 30.0),
+]
+START = datetime(2024, 1, 1)
+
+def serial_number(type_name, type_index, module):
+    # the type's position keeps SNs unique when type names share a prefix (TYPEA, TYPEB)
+    return f"20U{type_name[:2].upper()}{type_index:02d}{module:07d}"
+
+def make_defects(rng, run_numbers, test_types, n_channels_total, bad_rate):
+    defects = []
+    for test_idx, (run_number, test_type) in enumerate(zip(run_numbers, test_types)):
+        for _ in range(rng.poisson(bad_rate)):
+            start = int(rng.integers(n_channels_total))
+            props = {'runNumber': run_number, 'testType': test_type}
+            if rng.random() < 0.4:          # ranges of neighbouring channels, sometimes a whole chip
+                length = 128 if rng.random() < 0.05 else int(rng.integers(1, 12))
+                props.update(channel_from=start, channel_to=min(start + length, n_channels_total - 1))
+            else:
+                props['channel'] = start
+            defects.append({'name': 'BAD_CHANNEL', 'code': 'BAD_CHANNEL', 'properties': props})
+    return defects
+
+def make_test_run(rng, type_name, sn, upload, n_uploads, n_chips, n_channels, bad_rate):
+    # earlier uploads of an SN are superseded; some of them are incomplete
+    n_tests = N_TESTS if upload == n_uploads - 1 or rng.random() < 0.7 else int(rng.integers(15, N_TESTS))
+    first_run = 10000 + 100 * upload
+    run_numbers = [str(first_run + i) for i in range(N_TESTS)]
+    test_types = [TEST_TYPES[i % len(TEST_TYPES)] for i in range(N_TESTS)]
+    all_tests = [f"{run}_{test_type}" for run, test_type in zip(run_numbers, test_types)][:n_tests]
+    failed_tests = [test for test in all_tests if rng.random() < 0.03]
+    temps = [round(float(rng.normal(20 if i + 1 in WARM_TESTS else -35, 1.5)), 2) for i in range(N_TESTS)]
+
+    results = []
+    for name, dims, mean, spread in RESULTS:
+        shape = (N_TESTS, n_chips) if dims == 2 else (N_TESTS, n_chips, n_channels)
+        chip_offset = rng.normal(0, spread, size=(1, n_chips) + (1,) * (dims - 2))
+        values = np.round(mean + chip_offset + rng.normal(0, spread / 3, size=shape), 3)
+        results.append({'code': name.upper(), 'name': name, 'arrayDimensions': dims, 'value': values.tolist()})
+
+    state_ts = START + timedelta(days=30 * upload + int(rng.integers(30)), seconds=int(rng.integers(86400)))
+    return {
+        'testType': {'code': 'THERMAL_CYCLING', 'name': 'Thermal cycling'},
+        'runNumber': f"{zlib.crc32(sn.encode()) % 1000}-{upload}",
+        'institution': {'code': 'SYN', 'name': 'Synthetic Institute'},
+        'passed': not failed_tests,
+        'components': [{
+            'serialNumber': sn,
+            'ancestorMap': {'parent': {'component': {'type': {'code': 'PWB'}, 'serialNumber': f"20UPB{sn[-7:]}"}}},
+            'stateTs': state_ts.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+        }],
+        'properties': [
+            {'code': 'TEMPERATURES', 'value': {'AMAC_NTCy': temps}},
+            {'code': 'DUT', 'value': {'DUT_type': type_name, 'name': sn}},
+            {'code': 'SETUP', 'value': {'n_chips': n_chips}},
+            {'code': 'TESTS', 'value': {'all_tests': all_tests, 'failed_tests': failed_tests}},
+            {'code': 'GAIN', 'value': {'points': [0.52, 1.0, 1.48]}},
+        ],
+        'results': results,
+        'defects': make_defects(rng, run_numbers[:n_tests], test_types[:n_tests], n_chips * n_channels, bad_rate),
+        'stateTs': state_ts.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + 'Z'
+    }
+
+def generate(root, modules, types=('TYPEA',), uploads=3, n_chips=10, n_channels=128, bad_rate=2.0, seed=0):
+    # writes root/Type/SN/runN.json; returns the number of files and bytes written
+    n_files = 0
+    n_bytes = 0
+    for type_index, type_name in enumerate(types):
+        for module in range(modules):
+            sn = serial_number(type_name, type_index, module)
+            sn_dir = os.path.join(root, type_name, sn)
+            os.makedirs(sn_dir, exist_ok=True)
+            rng = np.random.default_rng([seed, zlib.crc32(type_name.encode()), zlib.crc32(sn.encode())])
+            for upload in range(uploads):
+                doc = make_test_run(rng, type_name, sn, upload, uploads, n_chips, n_channels, bad_rate)
+                path = os.path.join(sn_dir, f"run{upload}.json")
+                with open(path, 'w') as f:
+                    json.dump(doc, f)
+                n_files += 1
+                n_bytes += os.path.getsize(path)
+    return n_files, n_bytes
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Write a synthetic ITk thermal-cycle Type/SN/*.json tree")
+    parser.add_argument('root', help="output directory")
+    parser.add_argument('--modules', type=int, default=10, help="SerialNumbers per type")
+    parser.add_argument('--types', default='TYPEA', help="comma separated type names")
+    parser.add_argument('--uploads', type=int, default=3, help="uploads per SN, the last one is the latest")
+    parser.add_argument('--chips', type=int, default=10)
+    parser.add_argument('--channels', type=int, default=128, help="channels per chip")
+    parser.add_argument('--bad-rate', type=float, default=2.0, help="mean number of defects per test")
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    types = [type_name.strip() for type_name in args.types.split(',') if type_name.strip()]
+    n_files, n_bytes = generate(args.root, args.modules, types, args.uploads,
+                                args.chips, args.channels, args.bad_rate, args.seed)
+    print(f"{n_files} files, {n_bytes / 1e6:.1f} MB written to {args.root}")
+
+if __name__ == "__main__":
+    main()